@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 from equity_utils.api import InternalDataAPI
 from loguru import logger
 import pymysql
@@ -7,40 +8,181 @@ import io
 import glob
 from datetime import date
 import configparser
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import cache_utils
+import number_utils
+
+
+SYMBOLOGY_URL = "http://XYZ/rest/v1/marketData/instruments"
+SYMBOLOGY_COLUMNS = ['SECURITY_TYP_2', 'SECURITY_TYP']
+# The endpoint accepts at most 2000 instruments per request
+SYMBOLOGY_MAX_BATCH = 2000
+SYMBOLOGY_MIN_BATCH = 250
+SYMBOLOGY_TARGET_LATENCY = 5
+SYMBOLOGY_MAX_WORKERS = 4
+SYMBOLOGY_TIMEOUT = 60
+SYMBOLOGY_RETRIES = 3
+# Failed batches are retried after SYMBOLOGY_BACKOFF seconds, doubled with each further attempt
+SYMBOLOGY_BACKOFF = 1
+# Symbology records are kept on disk (see cache_utils.CACHE_DIR) and refetched once older than the TTL
+SYMBOLOGY_CACHE_PERSIST = True
+SYMBOLOGY_CACHE_TTL = 24 * 60 * 60
+
+# Timeouts of the universe database in seconds, the read timeout applies to each read from the socket
+UNIVERSE_DB_CONNECT_TIMEOUT = 30
+UNIVERSE_DB_READ_TIMEOUT = 300
+
+_symbology_cache = cache_utils.TTLFrameCache('symbology', 'RIC', SYMBOLOGY_COLUMNS, ttl=SYMBOLOGY_CACHE_TTL,
+                                             persist=SYMBOLOGY_CACHE_PERSIST)
+
+
+def _post_symbology_batch(session, batch):
+    """
+    Posts one batch of RICs to the marketData instruments endpoint
+    :param session: pooled requests session
+    :param batch: tuple of RICs
+    :return: list of instrument dicts and the latency of the request in seconds
+    """
+    start = time.perf_counter()
+    response = session.post(SYMBOLOGY_URL, json=[{'ID_RIC': ric} for ric in batch], timeout=SYMBOLOGY_TIMEOUT)
+    response.raise_for_status()
+    return response.json(), time.perf_counter() - start
+
+
+def _adapt_batch_size(batch_size, latencies, max_batch=SYMBOLOGY_MAX_BATCH):
+    """
+    Halves the batch size if the last requests were slower than the target latency, doubles it if they were much faster
+    :param batch_size: current batch size
+    :param latencies: latencies of the last requests in seconds
+    :param max_batch: largest batch size the endpoint accepted so far
+    :return: new batch size within the payload limits of the endpoint
+    """
+    if not latencies:
+        return batch_size
+    mean_latency = sum(latencies) / len(latencies)
+    if mean_latency > SYMBOLOGY_TARGET_LATENCY:
+        return max(SYMBOLOGY_MIN_BATCH, batch_size // 2)
+    if mean_latency < SYMBOLOGY_TARGET_LATENCY / 2:
+        return min(max_batch, batch_size * 2)
+    return batch_size
+
+
+def _post_symbology(ric_list):
+    """
+    Requests the symbology of the RICs from the marketData instruments endpoint. Batches are posted concurrently
+    over a pooled session, their size adapts to the observed latency and failed batches are retried on their own.
+    :param ric_list: list of unique RICs
+    :return: Dataframe indexed by RIC with the symbology columns, RICs unknown to the endpoint are left empty
+    """
+    instruments_df = pd.DataFrame(index=pd.Index(ric_list, name='RIC'), columns=SYMBOLOGY_COLUMNS, dtype=object)
+    batch_size = SYMBOLOGY_MAX_BATCH
+    # Batch sizes that were rejected as too large are not used again
+    max_batch = SYMBOLOGY_MAX_BATCH
+    offset = 0
+    retry_batches = []
+    attempts = {}
+
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=SYMBOLOGY_MAX_WORKERS) as executor:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=SYMBOLOGY_MAX_WORKERS)
+        session.mount('http://', adapter)
+        while offset < len(ric_list) or retry_batches:
+            # Dispatch one wave of batches, failed batches first
+            wave = []
+            while len(wave) < SYMBOLOGY_MAX_WORKERS and (retry_batches or offset < len(ric_list)):
+                if retry_batches:
+                    wave.append(retry_batches.pop())
+                else:
+                    wave.append(tuple(ric_list[offset:offset + batch_size]))
+                    offset += batch_size
+            # Back off exponentially before retrying failed batches
+            retried = [attempts[batch] for batch in wave if batch in attempts]
+            if retried:
+                time.sleep(SYMBOLOGY_BACKOFF * 2 ** (max(retried) - 1))
+            futures = {executor.submit(_post_symbology_batch, session, batch): batch for batch in wave}
+
+            latencies = []
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    instruments, latency = future.result()
+                # ValueError: the response body is not valid JSON (e.g. a truncated response)
+                except (requests.RequestException, ValueError) as err:
+                    attempts[batch] = attempts.get(batch, 0) + 1
+                    if attempts[batch] > SYMBOLOGY_RETRIES:
+                        logger.error(f'Symbology request for {len(batch)} RICs failed {attempts[batch]} times')
+                        raise err
+                    response = getattr(err, 'response', None)
+                    status = response.status_code if response is not None else None
+                    if status == 413 and len(batch) > 1:
+                        # Payload too large: retry both halves and send smaller batches from now on
+                        retry_batches += [batch[:len(batch) // 2], batch[len(batch) // 2:]]
+                        max_batch = max(SYMBOLOGY_MIN_BATCH, min(max_batch, len(batch) // 2))
+                        batch_size = min(batch_size, max_batch)
+                    else:
+                        retry_batches.append(batch)
+                    logger.warning(f'Symbology request for {len(batch)} RICs failed ({err}), retrying')
+                    continue
+
+                latencies.append(latency)
+                returned = pd.DataFrame(instruments, columns=['ID_RIC'] + SYMBOLOGY_COLUMNS)
+                returned = returned.drop_duplicates(subset='ID_RIC').set_index('ID_RIC')
+                found = returned.index.intersection(instruments_df.index)
+                instruments_df.loc[found, SYMBOLOGY_COLUMNS] = returned.loc[found, SYMBOLOGY_COLUMNS].values
+
+            batch_size = _adapt_batch_size(batch_size, latencies, max_batch)
+
+    return instruments_df
 
 
 def fetch_symbology(cash_div_df: pd.DataFrame):
-    max_instrument_request = 2000
-    ric_list = cash_div_df.drop_duplicates(subset='RIC')['RIC'].to_list()
-    all_instruments = []
-    temp_gigant_list = [{'ID_RIC': ric} for ric in ric_list]
-    body = [temp_gigant_list[i:i + max_instrument_request] for i in
-            range(0, len(temp_gigant_list), max_instrument_request)]
-    for body_split in body:
-        try:
-            response = requests.post("http://XYZ/rest/v1/marketData/instruments", json=body_split)
-            response.raise_for_status()
-            all_instruments += (response.json())
-        except requests.HTTPError as err:
-            print(f'Request was wrong')
-            raise err
-    reit_adr_instruments_df = pd.DataFrame(all_instruments)[['ID_RIC', 'SECURITY_TYP_2', 'SECURITY_TYP']].rename(
-        columns={'ID_RIC': 'RIC'})
+    """
+    Returns the symbology of all RICs in the dataframe. Only RICs that are not cached or whose cached
+    record is stale are requested from the API
+    :param cash_div_df: Dataframe with a RIC column
+    :return: Dataframe with RIC, SECURITY_TYP_2 and SECURITY_TYP
+    """
+    ric_list = cash_div_df['RIC'].dropna().drop_duplicates().to_list()
+    cached, missing = _symbology_cache.get(ric_list)
+    logger.debug(f'Symbology: {len(cached)} RICs cached, {len(missing)} RICs requested')
+    if missing:
+        fetched = _post_symbology(missing)
+        _symbology_cache.put(fetched)
+        cached = pd.concat([cached, fetched])
+    reit_adr_instruments_df = cached.rename_axis('RIC').reset_index()
     return reit_adr_instruments_df
 
 
 class Gigant_Generell_Information:
-    def __init__(self):
+    universe_columns = ['Name', 'sedol', 'ISIN', 'ID_MIC', 'RIC', 'TICKER']
+    universe_query = "SELECT inst.name, inst.sedol, inst.isin, inst.mic_code, inst.ric, inst.bbg_ticker FROM vnd_data_loader.shares_unique inst WHERE inst.is_in_use = '1'"
+    # Computed by the database over the same rows as the universe query, so only a single row is transferred.
+    # NULLs are replaced, since CONCAT_WS skips them, and rows are hashed with MD5, so that changes do not cancel out
+    row_hash = ("CAST(CONV(LEFT(MD5(CONCAT_WS('|', COALESCE(inst.name, '\\0'), COALESCE(inst.sedol, '\\0'), "
+                "COALESCE(inst.isin, '\\0'), COALESCE(inst.mic_code, '\\0'), COALESCE(inst.ric, '\\0'), "
+                "COALESCE(inst.bbg_ticker, '\\0'))), 16), 16, 10) AS UNSIGNED)")
+    checksum_query = f"SELECT COUNT(*), BIT_XOR({row_hash}), SUM({row_hash}) FROM vnd_data_loader.shares_unique inst WHERE inst.is_in_use = '1'"
+
+    def __init__(self, snapshot=True):
+        """
+        Loads the active instrument universe. With snapshot=True the universe is read from a local snapshot
+        and only reloaded from the database, if the checksum of the universe changed since the last sync
+        :param snapshot:
+        """
         config_path = 'config.ini'
         config = configparser.RawConfigParser()
         config.read(config_path)
-        self.__instruments_in_gigant = pd.DataFrame(
-            Gigant_Generell_Information.__get_gigant_instruments(config['gigant_universe_db']['username'],
-                                                                 config['gigant_universe_db']['password'],
-                                                                 config['gigant_universe_db']['host'],
-                                                                 config['gigant_universe_db']['port'],
-                                                                 f"SELECT inst.name, inst.sedol, inst.isin, inst.mic_code, inst.ric, inst.bbg_ticker FROM vnd_data_loader.shares_unique inst WHERE inst.is_in_use = '1'"),
-            columns=['Name', 'sedol', 'ISIN', 'ID_MIC', 'RIC', 'TICKER'])
+        db_con = pymysql.connect(host=config['gigant_universe_db']['host'],
+                                 user=config['gigant_universe_db']['username'],
+                                 password=config['gigant_universe_db']['password'],
+                                 port=int(config['gigant_universe_db']['port']),
+                                 connect_timeout=UNIVERSE_DB_CONNECT_TIMEOUT,
+                                 read_timeout=UNIVERSE_DB_READ_TIMEOUT,
+                                 write_timeout=UNIVERSE_DB_READ_TIMEOUT)
+        try:
+            self.__instruments_in_gigant = Gigant_Generell_Information.__load_universe(db_con, snapshot)
+        finally:
+            db_con.close()
 
     def get_all_instruments(self):
         """
@@ -78,29 +220,147 @@ class Gigant_Generell_Information:
         return to_be_mapped_to_ric_df
 
     @staticmethod
-    def __get_gigant_instruments(db_user, db_password, db_host, db_port, query):
+    def __load_universe(db_con, snapshot):
         """
-        Fetching Data from Gigant-Database (Ric, Isin, Sedol, Cusip, Bbg-Ticker, Status + Preprocessing of Data
-        Calls DatabaseConnection of Gigant_db_Collector
-        Params per input in commando line: database-user, db-password, db-host, db-port, db-name
-        :return: list
+        Returns the universe from the local snapshot if its checksum matches the database, otherwise reloads it
+        :param db_con: open database connection
+        :param snapshot: if False, the universe is always reloaded and no snapshot is kept
+        :return: Dataframe with all active instruments
         """
-
-        db_con = pymysql.connect(
-            host=db_host, user=db_user, password=db_password, port=int(db_port)
-        )
+        snapshot_path = cache_utils.cache_path('universe', 'shares_unique')
         with db_con.cursor() as cursor:
-            cursor.execute(query)
-            instrument_data = cursor.fetchall()
+            cursor.execute(Gigant_Generell_Information.checksum_query)
+            checksum = [str(value) for value in cursor.fetchone()]
+
+        # An unreadable checksum file counts as a stale snapshot
+        stored_checksum = cache_utils.read_json(snapshot_path + '.json') if snapshot else None
+        if stored_checksum is not None:
+            instruments = cache_utils.read_frame(snapshot_path)
+            if stored_checksum == checksum and instruments is not None:
+                logger.debug(f'Universe unchanged since last sync, read {len(instruments)} instruments from snapshot')
+                return instruments
+
+        logger.debug('Universe changed since last sync, reloading from database...')
+        instruments = Gigant_Generell_Information.__get_gigant_instruments(db_con,
+                                                                           Gigant_Generell_Information.universe_query)
+        if snapshot:
+            cache_utils.write_frame(instruments, snapshot_path)
+            cache_utils.write_json(checksum, snapshot_path + '.json')
+        return instruments
 
-        db_con.close()
-        return instrument_data
+    @staticmethod
+    def __get_gigant_instruments(db_con, query, chunk_size=50000):
+        """
+        Fetching Data from Gigant-Database (Ric, Isin, Sedol, Cusip, Bbg-Ticker, Status + Preprocessing of Data
+        Rows are streamed with a server-side cursor and converted to a dataframe chunk by chunk
+        :param db_con: open database connection
+        :param query:
+        :return: Dataframe
+        """
+        chunks = []
+        with db_con.cursor(pymysql.cursors.SSCursor) as cursor:
+            cursor.execute(query)
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                chunks.append(pd.DataFrame(list(rows), columns=Gigant_Generell_Information.universe_columns))
+                rows = cursor.fetchmany(chunk_size)
+
+        if not chunks:
+            return pd.DataFrame(columns=Gigant_Generell_Information.universe_columns)
+        return pd.concat(chunks, ignore_index=True)
+
+
+# Compact dtypes of the normalised vendor frames
+CA_SCHEMA = {
+    'RIC': 'category',
+    'Type': 'category',
+    'Currency': 'category',
+    'Dividend Taxation Type': 'category',
+    'Execution Date': 'datetime64[ns]',
+    'Stock Dividend': 'float64',
+    'Terms': 'float64',
+    'Subscription Price': 'float64',
+    'GROSS': 'float64',
+    'NET': 'float64',
+    'Value': 'float64',
+}
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the columns of a normalised vendor frame to the compact dtypes of CA_SCHEMA
+    :param df:
+    :return:
+    """
+    return df.astype({col: dtype for col, dtype in CA_SCHEMA.items() if col in df.columns})
+
+
+class ParseReport:
+    """
+    Collects the values of a vendor that could not be parsed and logs them as one summary
+    """
+    def __init__(self, vendor):
+        self.vendor = vendor
+        self.issues = {}
+
+    def add(self, column, values: pd.Series):
+        if not values.empty:
+            self.issues.setdefault(column, []).extend(values.astype(str).tolist())
+
+    def log(self):
+        if not self.issues:
+            return None
+        summary = "; ".join(f"{column}: {len(values)} values (e.g. {', '.join(values[:3])})"
+                            for column, values in self.issues.items())
+        logger.warning(f'{self.vendor} values could not be parsed and were replaced: {summary}')
+        self.issues = {}
+        return None
+
+
+def _format_relations(ratio: pd.Series) -> pd.Series:
+    """
+    Formats ratios as "x:y" relations, where the smaller side is 1
+    :param ratio: series of positive ratios
+    :return: series of relations, missing where the ratio is missing or not positive
+    """
+    ratio = ratio.astype(float)
+    ratio = ratio.where(ratio > 0)
+    below_one = ratio < 1
+    inverse = number_utils.round_values(1 / ratio.where(below_one))
+    relations = pd.Series(np.where(below_one, '1:' + inverse.astype(str),
+                                   number_utils.round_values(ratio).astype(str) + ':1'),
+                          index=ratio.index, dtype=object)
+    return relations.where(ratio.notnull())
+
+
+_RATIO_PATTERN = r'^\s*(?P<dividend>[^:]+?)\s*(?::\s*(?P<divisor>[^:]+?)\s*)?$'
+
+
+def _parse_ratios(ratios: pd.Series):
+    """
+    Parses ratios given as number or as "a:b" string with a single regex extraction
+    :param ratios: series of ratios
+    :return: series of ratios (missing if unparseable) and mask of ratios whose divisor is given as "--"
+    """
+    parts = ratios.astype(str).str.extract(_RATIO_PATTERN)
+    placeholder = parts['divisor'].str.strip() == '--'
+    dividend = pd.to_numeric(parts['dividend'], errors='coerce')
+    divisor = pd.to_numeric(parts['divisor'].where(~placeholder), errors='coerce')
+    ratio = dividend.where(parts['divisor'].isnull(), dividend / divisor)
+    return ratio.replace([np.inf, -np.inf], np.nan), placeholder
 
 
 class GigantCAs:
-    def __init__(self, start_date, end_date):
+    def __init__(self, start_date, end_date, snapshot=False):
+        """
+        Pulls the platform CAs for the date window
+        :param start_date:
+        :param end_date:
+        :param snapshot: if True, the pull is stored in / read from a local snapshot of the date window
+        """
         self.start_date = start_date
         self.end_date = end_date
+        self.snapshot = snapshot
         self.df = None
         self._pull_cas()
 
@@ -108,22 +368,24 @@ class GigantCAs:
         relevant_columns = ["RIC", "Type", "Execution Date", "Stock Dividend"]
         df = self.df.query("Type == 'STOCK_DIVIDEND'")
         df = df.drop(columns=df.columns.difference(relevant_columns))
-        df["Stock Dividend"] = df["Stock Dividend"].apply(lambda x: round(x, 6))
+        df["Stock Dividend"] = number_utils.round_values(df["Stock Dividend"])
         return df
 
     def get_stock_splits(self):
         relevant_columns = ["RIC", "Type", "Execution Date", "Relation"]
         df = self.df.query("Type == 'STOCK_SPLIT'")
         df = df.drop(columns=df.columns.difference(relevant_columns))
-        df["Relation"] = df["Relation"].apply(self._clean_relations)
+        df["Relation"] = self._clean_relations(df["Relation"])
         return df
 
     def get_cash_dividends(self):
         relevant_columns = ["RIC", "Type", "Execution Date", "GROSS", "NET", "Currency", "Dividend Taxation Type",
                             "Franking amount", "CFI amount", "PID percent"]
         df = self.df.query("Type == 'CASH_DIVIDEND' | Type == 'SPECIAL_DIVIDEND'")
-        df.loc[:, "GROSS"] = df.apply(lambda row: self._get_value(row, gross=True), axis=1)
-        df.loc[:, "NET"] = df.apply(lambda row: self._get_value(row, gross=False), axis=1)
+        # Route the value to GROSS or NET depending on the withholding tax type
+        value = number_utils.round_values(df["Value"])
+        df.loc[:, "GROSS"] = value.where(df["Withholding Tax Type"] == "GROSS")
+        df.loc[:, "NET"] = value.where(df["Withholding Tax Type"] == "NET")
         df = df.drop(columns=df.columns.difference(relevant_columns))
         return df
 
@@ -131,38 +393,28 @@ class GigantCAs:
         relevant_columns = ["RIC", "Type", "Execution Date", "Terms", "Subscription Price", "Currency"]
         df = self.df.query("Type == 'RIGHTS_ISSUE'")
         df = df.drop(columns=df.columns.difference(relevant_columns))
-        df["Terms"] = df["Terms"].apply(lambda x: round(x, 6))
+        df["Terms"] = number_utils.round_values(df["Terms"])
         return df
 
     @staticmethod
-    def _get_value(row, gross=True):
-        if gross:
-            column_name = "GROSS"
-        else:
-            column_name = "NET"
-
-        value = round(row["Value"], 6) if row["Withholding Tax Type"] == column_name else None
-        return value
-
-    @staticmethod
-    def _clean_relations(relation: str):
-        relation = relation.split(":")
-        dividend = float(relation[0])
-        divisor = float(relation[1])
-        ratio = dividend / divisor
-        if ratio < 1:
-            x = 1
-            y = round(1 / ratio, 6)
-        else:
-            x = round(ratio, 6)
-            y = 1
-
-
-        return f"{x}:{y}"
+    def _clean_relations(relations: pd.Series):
+        ratio, _ = _parse_ratios(relations)
+        return _format_relations(ratio)
 
     def _pull_cas(self):
+        # Without snapshot, no cache directory is created
+        snapshot_path = None
+        if self.snapshot:
+            snapshot_path = cache_utils.cache_path('platform', f'plat_cas_{self.start_date}_{self.end_date}')
+            self.df = cache_utils.read_frame(snapshot_path)
+            if self.df is not None:
+                logger.debug(f'Read Platform data from snapshot: {snapshot_path}')
+                return None
+
         self.df = InternalDataAPI().corporate_actions(self.start_date, self.end_date)
         self.df["Execution Date"] = pd.to_datetime(self.df["Execution Date"])
+        if self.snapshot:
+            cache_utils.write_frame(self.df, snapshot_path)
         if self.df.empty:
             logger.warning(
                 f"Corporate Actions from the Platform are empty! This makes only sense for very short timespans.")
@@ -173,6 +425,7 @@ class ReutersCAs:
         self.df = df
         self.start_date = start_date
         self.end_date = end_date
+        self.report = ParseReport('Reuters')
 
     def __date_filtering(self, df):
         df = df[(df['Execution Date'] >= self.start_date) & (df['Execution Date'] <= self.end_date)]
@@ -192,13 +445,13 @@ class ReutersCAs:
 
         df["Type"] = "STOCK_DIVIDEND"
 
-        df["Execution Date"] = df["Execution Date"].apply(self.clean_execution_date)
+        df["Execution Date"] = self.clean_execution_date(df["Execution Date"])
 
         df = self.__date_filtering(df)
 
-        df["Stock Dividend"] = df["Stock Dividend"].apply(
-            lambda x: self.calc_terms(x) * 100)  # *100 because Platform stores it in percentage
+        df["Stock Dividend"] = self.calc_terms(df["Stock Dividend"], "Stock Dividend") * 100  # *100 because Platform stores it in percentage
 
+        self.report.log()
         return df
 
     def get_share_splits(self):
@@ -213,9 +466,10 @@ class ReutersCAs:
         df = df.drop(columns=df.columns.difference(column_mapping))
         df = df.rename(columns=column_mapping)
         df["Type"] = "STOCK_SPLIT"
-        df["Execution Date"] = df["Execution Date"].apply(self.clean_execution_date)
-        df["Relation"] = df["Relation"].apply(self.calc_relation)
+        df["Execution Date"] = self.clean_execution_date(df["Execution Date"])
+        df["Relation"] = self.calc_relation(df["Relation"], "Relation")
         df = self.__date_filtering(df)
+        self.report.log()
         return df
 
     def get_cash_dividends(self):
@@ -230,14 +484,15 @@ class ReutersCAs:
             "Unnamed: 9": "Type_div"}
         df = df.drop(columns=df.columns.difference(column_mapping))
         df = df.rename(columns=column_mapping)
-        df["Type"] = df["Type_div"].apply(lambda x: "SPECIAL_DIVIDEND" if (
-                    "extraordinary " in x.lower() or "special" in x.lower()) else "CASH_DIVIDEND")
-        df["Execution Date"] = df["Execution Date"].apply(self.clean_execution_date)
-        df["Currency"] = df["GROSS"].apply(lambda x: x.split(" ")[-1])
-        df["GROSS"] = df["GROSS"].apply(lambda x: self.string_to_float(x.split(":")[-1]))
-        df["NET"] = df["NET"].apply(lambda x: self.string_to_float(x.split(":")[-1]))
+        special = df["Type_div"].str.lower().str.contains("extraordinary |special", na=False)
+        df["Type"] = np.where(special, "SPECIAL_DIVIDEND", "CASH_DIVIDEND")
+        df["Execution Date"] = self.clean_execution_date(df["Execution Date"])
+        df["Currency"] = df["GROSS"].str.split(" ").str[-1]
+        df["GROSS"] = self.string_to_float(df["GROSS"].str.split(":").str[-1], "GROSS")
+        df["NET"] = self.string_to_float(df["NET"].str.split(":").str[-1], "NET")
         df = df.drop(columns=["Type_div"])
         df = self.__date_filtering(df)
+        self.report.log()
         return df
 
     def get_rights_issues(self):
@@ -250,18 +505,22 @@ class ReutersCAs:
         df = df.drop(columns=df.columns.difference(column_mapping))
         df = df.rename(columns=column_mapping)
         df["Type"] = "RIGHTS_ISSUE"
-        df["Execution Date"] = df["Execution Date"].apply(self.clean_execution_date)
-        df["Terms"] = df["Terms"].apply(self.calc_terms)
+        df["Execution Date"] = self.clean_execution_date(df["Execution Date"])
+        df["Terms"] = self.calc_terms(df["Terms"], "Terms")
         df = self.clean_rights_issues(df)
         df = self.__date_filtering(df)
+        self.report.log()
         return df
 
-    @staticmethod
-    def clean_execution_date(ex_date: str):
-        if ex_date[-2:] == "--":
-            return pd.Timestamp("1900-01-01")
-        date = ex_date.split(":")[-1].strip()
-        return pd.Timestamp(date)
+    def clean_execution_date(self, ex_dates: pd.Series):
+        """
+        Parses "label: date" strings, dates given as "--" are set to 1900-01-01
+        """
+        ex_dates = ex_dates.astype(str)
+        placeholder = ex_dates.str[-2:] == "--"
+        dates = pd.to_datetime(ex_dates.str.split(":").str[-1].str.strip().where(~placeholder), errors='coerce')
+        self.report.add("Execution Date", ex_dates[dates.isnull() & ~placeholder])
+        return dates.where(~placeholder, pd.Timestamp("1900-01-01"))
 
     @staticmethod
     def clean_rights_issues(df):
@@ -269,46 +528,40 @@ class ReutersCAs:
         df = df.loc[df["Terms"] != 0]
         return df
 
-    @staticmethod
-    def calc_relation(relation: str):
-        relation = relation.split(":")
-        if relation[1].strip() == "--":
-            return 0
-        dividend = ReutersCAs.string_to_float(relation[2])
-        divisor = ReutersCAs.string_to_float(relation[1])
-        ratio = dividend / divisor
-        if ratio < 1:
-            x = 1
-            y = round(1 / ratio, 6)
-        else:
-            x = round(ratio, 6)
-            y = 1
-
-
-        return f"{x}:{y}"
+    def calc_relation(self, relations: pd.Series, column):
+        """
+        Parses "label: old : new" strings to "x:y" relations, relations given as "--" are set to 0
+        """
+        ratio, placeholder = self._calc_ratios(relations, column)
+        return _format_relations(ratio).where(~placeholder, 0)
 
-    @staticmethod
-    def calc_terms(terms: str):
-        terms = terms.split(":")
-        if terms[1].strip() == "--":
-            return 0
-        dividend = ReutersCAs.string_to_float(terms[2])
-        divisor = ReutersCAs.string_to_float(terms[1])
-        ratio = dividend / divisor
-        return round(ratio, 6)
+    def calc_terms(self, terms: pd.Series, column):
+        """
+        Parses "label: old : new" strings to new/old ratios, terms given as "--" or unparseable terms are set to 0
+        """
+        ratio, placeholder = self._calc_ratios(terms, column)
+        return number_utils.round_values(ratio).where(~placeholder, 0).fillna(0)
+
+    def _calc_ratios(self, terms: pd.Series, column):
+        parts = terms.astype(str).str.split(":")
+        placeholder = parts.str[1].str.strip() == "--"
+        ratio = self._to_numbers(parts.str[2]) / self._to_numbers(parts.str[1])
+        ratio = ratio.replace([np.inf, -np.inf], np.nan)
+        self.report.add(column, terms[ratio.isnull() & ~placeholder])
+        return ratio, placeholder
+
+    def string_to_float(self, numbers: pd.Series, column):
+        """
+        Parses numbers like "1,234.5 USD", unparseable numbers are set to 0
+        """
+        values = self._to_numbers(numbers)
+        self.report.add(column, numbers[values.isnull()])
+        return values.fillna(0)
 
     @staticmethod
-    def string_to_float(number: str):
-        copy = number
-        number = number.strip()
-        number = number.split(" ")[0] if " " in number else number
-        try:
-            number = round(float(number.strip().replace(",", "")), 6)
-            return number
-        except Exception as e:
-            logger.debug(e)
-            logger.warning(f'String could not be converted to number: {copy}. Using 0 instead')
-            return 0
+    def _to_numbers(numbers: pd.Series):
+        numbers = numbers.astype(str).str.strip().str.split(" ").str[0].str.replace(",", "", regex=False)
+        return number_utils.round_values(pd.to_numeric(numbers, errors='coerce'))
 
 
 class EdiCAs:
@@ -316,16 +569,15 @@ class EdiCAs:
         self.df = df
         self.start_date = start_date
         self.end_date = end_date
+        self.report = ParseReport('EDI')
 
     def get_stock_dividends(self):
         relevant_columns = ["RIC", "Type", "Execution Date", "Stock Dividend"]
-        df = self.df.loc[self.df['Type'].str.contains("STOCK_DIVIDEND"), :]
-        df.loc[self.df['Type'].str.contains('STOCK_DIVIDEND'), 'Type'] = 'STOCK_DIVIDEND'
+        df = self.df.loc[self.df['Type'].str.contains("STOCK_DIVIDEND", na=False), :]
         df = df.drop(columns=df.columns.difference(relevant_columns))
-        df["Stock Dividend"] = df["Stock Dividend"].apply(
-            lambda x: self.calc_terms(x) * 100)
-        df["Stock Dividend"] = df["Stock Dividend"].apply(lambda x: round(x, 6))
-        # df.dropna(subset=["Stock Dividend"], inplace=True)
+        df["Type"] = 'STOCK_DIVIDEND'
+        df["Stock Dividend"] = number_utils.round_values(self.calc_terms(df["Stock Dividend"], "Stock Dividend") * 100)
+        self.report.log()
         return df
 
     def get_stock_splits(self):
@@ -333,18 +585,20 @@ class EdiCAs:
         df = self.df.query("Type == 'STOCK_SPLIT'")
 
         df = df.drop(columns=df.columns.difference(relevant_columns))
-        df["Relation"] = df["Relation"].apply(self._clean_relations)
+        df["Relation"] = self._clean_relations(df["Relation"], "Relation")
+        self.report.log()
         return df
 
     def get_cash_dividends(self):
         relevant_columns = ["RIC", "Type", "Execution Date", "GROSS", "NET", "Currency", "Source", "Tax Rate"]
-        df = self.df.loc[(self.df['Type'].str.contains('CASH_DIVIDEND')) | (self.df['Type'].str.contains('SPECIAL_DIVIDEND'))]
-        df.loc[self.df['Type'].str.contains('CASH_DIVIDEND'), 'Type'] = 'CASH_DIVIDEND'
-        df.loc[self.df['Type'].str.contains('SPECIAL_DIVIDEND'), 'Type'] = 'SPECIAL_DIVIDEND'
-        df.loc[(df.GROSS.isnull() & df.NET.isnull()), "GROSS"] = df.loc[
-            (df.GROSS.isnull() & df.NET.isnull()), "REPORTED_AMT"]
-        df.loc[(df.GROSS.isnull() & df.NET.isnull()), "NET"] = df.loc[
-            (df.GROSS.isnull() & df.NET.isnull()), "REPORTED_AMT"]
+        is_cash = self.df['Type'].str.contains('CASH_DIVIDEND', na=False)
+        is_special = self.df['Type'].str.contains('SPECIAL_DIVIDEND', na=False)
+        df = self.df.loc[is_cash | is_special]
+        df["Type"] = np.where(is_special[df.index], 'SPECIAL_DIVIDEND', 'CASH_DIVIDEND')
+
+        # Use the reported amount as gross amount, if neither gross nor net amount is given
+        no_amount = df["GROSS"].isnull() & df["NET"].isnull()
+        df.loc[no_amount, "GROSS"] = df.loc[no_amount, "REPORTED_AMT"]
 
         df = df.drop(columns=df.columns.difference(relevant_columns))
         return df
@@ -356,8 +610,9 @@ class EdiCAs:
         df1["Currency"] = df["Subscription Currency"]
         df1 = df1.drop(columns=df.columns.difference(relevant_columns))
 
-        df1["Terms"] = df1["Terms"].apply(self.calc_terms)
+        df1["Terms"] = self.calc_terms(df1["Terms"], "Terms")
 
+        self.report.log()
         return df1
 
     @staticmethod
@@ -370,40 +625,18 @@ class EdiCAs:
         value = round(row["Value"], 6) if row["Withholding Tax Type"] == column_name else None
         return value
 
-    @staticmethod
-    def _clean_relations(relation: str):
-        try:
-            ratio = float(relation)
-        except:
-
-            relation = relation.split(":")
-
-            if relation[1].strip() == "--":
-                return 0
-
-            dividend = float(relation[0])
-            divisor = float(relation[1])
-            ratio = dividend / divisor
-
-        if ratio < 1:
-            x = 1
-            y = round(1 / ratio, 6)
-        else:
-            x = round(ratio, 6)
-            y = 1
-
-        return f"{x}:{y}"
+    def _clean_relations(self, relations: pd.Series, column):
+        """
+        Parses relations given as ratio or "a:b" to "x:y" relations, relations given as "a:--" are set to 0
+        """
+        ratio, placeholder = _parse_ratios(relations)
+        self.report.add(column, relations[relations.notnull() & ratio.isnull() & ~placeholder])
+        return _format_relations(ratio).where(~placeholder, 0)
 
-    @staticmethod
-    def calc_terms(terms: str):
-        try:
-            ratio = round(float(terms), 6)
-        except:
-            terms = terms.split(":")
-
-            if terms[1].strip() == "--":
-                return 0
-            dividend = float(terms[0])
-            divisor = float(terms[1])
-            ratio = dividend / divisor
-        return round(ratio, 6)
+    def calc_terms(self, terms: pd.Series, column):
+        """
+        Parses terms given as ratio or "a:b" to ratios, terms given as "a:--" are set to 0
+        """
+        ratio, placeholder = _parse_ratios(terms)
+        self.report.add(column, terms[terms.notnull() & ratio.isnull() & ~placeholder])
+        return number_utils.round_values(ratio).where(~placeholder, 0)
@@ -0,0 +1,163 @@
+import pandas as pd
+from loguru import logger
+import threading
+import time
+import os
+import json
+
+CACHE_DIR = os.path.join(os.getcwd(), 'cache')
+
+
+def cache_path(*parts):
+    """
+    Returns a path inside the local cache directory and creates its parent directory
+    :param parts: path components below the cache directory
+    :return: path
+    """
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _write_atomic(write, path):
+    """
+    Writes to a temporary file that replaces the target once it is complete, so that an interrupted
+    or concurrent write never leaves a truncated file under the target path
+    :param write: function writing to the given path
+    :param path: target path
+    :return:
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        _remove(tmp_path)
+
+
+def write_frame(df, path):
+    """
+    Stores a dataframe as Parquet. Frames that Arrow cannot represent (e.g. mixed-type object columns) are pickled
+    :param df: dataframe to store
+    :param path: path without file extension
+    :return: path of the written file
+    """
+    try:
+        _write_atomic(lambda tmp_path: df.to_parquet(tmp_path, index=False), path + '.parquet')
+        _remove(path + '.pkl')
+        return path + '.parquet'
+    except Exception as e:
+        logger.debug(f'Could not store {path} as Parquet ({e}), using pickle instead')
+        _remove(path + '.parquet')
+        _write_atomic(df.to_pickle, path + '.pkl')
+        return path + '.pkl'
+
+
+def read_frame(path):
+    """
+    Reads a dataframe stored with write_frame. Files that cannot be read are removed and treated as missing
+    :param path: path without file extension
+    :return: dataframe or None, if nothing (readable) is stored under the path
+    """
+    for extension, read in [('.parquet', pd.read_parquet), ('.pkl', pd.read_pickle)]:
+        if not os.path.exists(path + extension):
+            continue
+        try:
+            return read(path + extension)
+        except Exception as e:
+            logger.warning(f'Could not read cached {path + extension} ({e}), removing it')
+            _remove(path + extension)
+    return None
+
+
+def write_json(obj, path):
+    """
+    Stores an object as JSON, atomically like write_frame
+    :param obj:
+    :param path:
+    :return:
+    """
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)
+    _write_atomic(write, path)
+
+
+def read_json(path):
+    """
+    Reads an object stored with write_json
+    :param path:
+    :return: object or None, if the file does not exist or cannot be read
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (ValueError, OSError) as e:
+        logger.warning(f'Could not read {path} ({e}), ignoring it')
+        return None
+
+
+class TTLFrameCache:
+    """
+    Run-wide cache of per-key records, optionally persisted on disk. Records older than the ttl are treated as missing
+    """
+    def __init__(self, name, key, value_columns, ttl=None, persist=False):
+        self.name = name
+        self.key = key
+        self.value_columns = value_columns
+        self.ttl = ttl
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._records = pd.DataFrame(columns=[key] + value_columns + ['fetched_at']).set_index(key)
+        # Persisted records are loaded on first use, not when the cache is created (e.g. on import)
+        self._loaded = not persist
+
+    def get(self, keys):
+        """
+        Looks up the keys in the cache
+        :param keys: list of unique keys
+        :return: dataframe with the cached records (indexed by key) and list of keys that are missing or stale
+        """
+        with self._lock:
+            self._load()
+            records = self._records
+        if self.ttl is not None:
+            records = records.loc[records['fetched_at'] >= time.time() - self.ttl]
+        hits = records.loc[records.index.intersection(keys), self.value_columns]
+        missing = [k for k in keys if k not in hits.index]
+        return hits, missing
+
+    def put(self, df):
+        """
+        Adds fetched records to the cache and writes the cache to disk if persistence is enabled
+        :param df: dataframe indexed by key containing the value columns
+        :return:
+        """
+        if df.empty:
+            return None
+        df = df[self.value_columns].assign(fetched_at=time.time())
+        with self._lock:
+            self._load()
+            records = pd.concat([self._records.loc[~self._records.index.isin(df.index)], df])
+            records.index.name = self.key
+            self._records = records
+        if self.persist:
+            write_frame(records.reset_index(), cache_path(self.name))
+        return None
+
+    def _load(self):
+        if self._loaded:
+            return None
+        self._loaded = True
+        stored = read_frame(cache_path(self.name))
+        if stored is not None:
+            self._records = stored.set_index(self.key)
+            logger.debug(f'Loaded {len(stored)} cached {self.name} records')
+        return None
@@ -1,12 +1,55 @@
 import pandas as pd
+import numpy as np
 from loguru import logger
+from concurrent.futures import ThreadPoolExecutor
 import data_import
+import ca_types
+import validation_state
+import number_utils
+
+def _encode_keys(dfs, key):
+    """
+    Encodes the key columns of the dataframes jointly into a single int64 code per row.
+    Missing key values are encoded like any other value, so they match each other as in pd.merge
+    :param dfs:
+    :param key:
+    :return: list with the codes of each dataframe and dataframe of the key values indexed by code
+    """
+    stacked = pd.concat([df[key] for df in dfs], ignore_index=True)
+    codes = np.zeros(len(stacked), dtype='int64')
+    for col in key:
+        col_codes, uniques = pd.factorize(stacked[col])
+        codes = codes * (len(uniques) + 1) + (col_codes + 1)
+    key_values = stacked.set_index(pd.Index(codes))
+    key_values = key_values.loc[~key_values.index.duplicated()]
+    bounds = np.cumsum([0] + [len(df) for df in dfs])
+    return [codes[start:end] for start, end in zip(bounds[:-1], bounds[1:])], key_values
+
+
+def _join_on_key(left, right, key):
+    """
+    Outer joins two dataframes on the encoded key
+    :return: joined dataframe with the key columns first
+    """
+    (left_codes, right_codes), key_values = _encode_keys([left, right], key)
+    joined = left.drop(columns=key).set_index(pd.Index(left_codes)).join(
+        right.drop(columns=key).set_index(pd.Index(right_codes)), how='outer')
+    return pd.concat([key_values.reindex(joined.index), joined], axis=1).reset_index(drop=True)
+
+
+def _equal_values(values_1, values_2):
+    """
+    Compares two value arrays element-wise, missing values never match
+    """
+    return (values_1 == values_2) & ~pd.isnull(values_1) & ~pd.isnull(values_2)
+
 
 def compare_ca(dfs, key, gigant_general, per_column = False):
     """
     Compares the Corporate actions between Reuters, EDI and the platform.
-    Observations are merged on the specified key and compared upon the remaining columns.
+    Observations are joined on the specified key and compared upon the remaining columns.
     Matching columns only indicate 'True' if all columns are equal between two vendors.
+    The input dataframes are not modified.
     :param dfs:
     :param key:
     :return:
@@ -14,37 +57,30 @@ def compare_ca(dfs, key, gigant_general, per_column = False):
     # Determine columns that are not part of the key
     vendor_names = ['Reuters', 'EDI', 'Plat']
     cols_not_key = dfs[0].columns[~dfs[0].columns.isin(key)].to_list()
-    not_key_names = {'Reuters':[],
-                     'EDI':[],
-                     'Plat':[]}
-    # Rename columns that are not part of key to: Vendor_column
-    for i, df in enumerate(dfs):
-        for col_name in cols_not_key:
-            not_key_name = f'{vendor_names[i]}_{col_name}'
-            not_key_names[vendor_names[i]].append(not_key_name)
-            df.rename({col_name: not_key_name}, axis=1, inplace=True)
+    # Name columns that are not part of key: Vendor_column
+    not_key_names = {vendor: [f'{vendor}_{col_name}' for col_name in cols_not_key] for vendor in vendor_names}
+    reuters, edi, plat = [df.rename(columns=dict(zip(cols_not_key, not_key_names[vendor])), copy=False)
+                          for vendor, df in zip(vendor_names, dfs)]
 
     # Combine data from vendors based on key
-    edi_plat = pd.merge(dfs[2], dfs[1], how='outer', on=key)
-    reuters_edi_plat = pd.merge(edi_plat, dfs[0], how='outer', on=['RIC', 'Type', 'Execution Date'])
+    edi_plat = _join_on_key(plat, edi, key)
+    reuters_edi_plat = _join_on_key(edi_plat, reuters, ['RIC', 'Type', 'Execution Date'])
 
     # If comparison per column, check all non-key columns individually
     if per_column:
         for col in cols_not_key:
-            reuters_edi_plat[f'Reuters-EDI_{col}'] = reuters_edi_plat[f'Reuters_{col}'] == reuters_edi_plat[f'EDI_{col}']
-            reuters_edi_plat[f'Reuters-Plat_{col}'] = reuters_edi_plat[f'Reuters_{col}'] == reuters_edi_plat[f'Plat_{col}']
-            reuters_edi_plat[f'EDI-Plat_{col}'] = reuters_edi_plat[f'EDI_{col}'] == reuters_edi_plat[f'Plat_{col}']
+            values = {vendor: reuters_edi_plat[f'{vendor}_{col}'].to_numpy(dtype=object) for vendor in vendor_names}
+            reuters_edi_plat[f'Reuters-EDI_{col}'] = _equal_values(values['Reuters'], values['EDI'])
+            reuters_edi_plat[f'Reuters-Plat_{col}'] = _equal_values(values['Reuters'], values['Plat'])
+            reuters_edi_plat[f'EDI-Plat_{col}'] = _equal_values(values['EDI'], values['Plat'])
 
     # If columns are not compared individually
     else:
-        # Reset column names for the vendor-specific columns to enable comparison
-        check_reuters = reuters_edi_plat[not_key_names['Reuters']].T.reset_index(drop=True).T
-        check_edi = reuters_edi_plat[not_key_names['EDI']].T.reset_index(drop=True).T
-        check_plat = reuters_edi_plat[not_key_names['Plat']].T.reset_index(drop=True).T
         # Compare vendor information based on vendor specific information
-        reuters_edi_plat['Reuters-EDI'] = (check_reuters == check_edi).all(axis=1)
-        reuters_edi_plat['Reuters-Plat'] = (check_reuters == check_plat).all(axis=1)
-        reuters_edi_plat['EDI-Plat'] = (check_edi == check_plat).all(axis=1)
+        values = {vendor: reuters_edi_plat[not_key_names[vendor]].to_numpy(dtype=object) for vendor in vendor_names}
+        reuters_edi_plat['Reuters-EDI'] = _equal_values(values['Reuters'], values['EDI']).all(axis=1)
+        reuters_edi_plat['Reuters-Plat'] = _equal_values(values['Reuters'], values['Plat']).all(axis=1)
+        reuters_edi_plat['EDI-Plat'] = _equal_values(values['EDI'], values['Plat']).all(axis=1)
 
     # adds ISIN and bbg-ticker to pd.Dataframe
     try:
@@ -70,15 +106,16 @@ def remove_duplicates(data_dict):
 
     return data_dict
 
-def add_rights_event_type(rights_df, gigant_instance):
+def add_rights_event_type(rights_df, gigant_instance, ice_capital_events_data=None):
     """
     Add Event type information from ICE to Rights Issue data
     :param rights_df:
+    :param ice_capital_events_data: prefetched ICE data, pulled from ICE if not given
     :return:
     """
     # Pull data from ICE and filter data
-    ice_capital_events_data = pd.read_csv('XYZ/ice-equity-ca/rest/v1/corporate-action/instruments?event_type=CapitalEvents')
-    ice_capital_events_data = ice_capital_events_data[['ISIN', 'Event_type', 'MIC', 'SEDOL']]
+    if ice_capital_events_data is None:
+        ice_capital_events_data = data_import.get_ice_capital_events()
 
     # map ISIN, MIC and SEDOL to RIC
     ice_capital_events_data = gigant_instance.get_ric(ice_capital_events_data)
@@ -92,156 +129,322 @@ def add_rights_event_type(rights_df, gigant_instance):
 
     return merged
 
-def max_decimal_equality(row, col_1, col_2):
+def max_decimal_equality(values_1, values_2, max_digits=10):
     """
-    Compares two columns of a row and returns the minimum rounding digits for the values to still be equal
-    :param float_1:
-    :param float_2:
-    :return:
+    Compares two value arrays element-wise and returns the maximum rounding digits for the values to still be equal
+    :param values_1:
+    :param values_2:
+    :param max_digits: highest precision that is checked
+    :return: array of digits, -1 where the values are not equal at any precision or not numeric
+    """
+    values_1 = pd.to_numeric(pd.Series(values_1), errors='coerce').to_numpy(dtype=float)
+    values_2 = pd.to_numeric(pd.Series(values_2), errors='coerce').to_numpy(dtype=float)
+    digits = np.arange(max_digits + 1)[:, np.newaxis]
+    scale = 10.0 ** digits
+    scaled_1 = values_1 * scale
+    scaled_2 = values_2 * scale
+    # Row i holds the equality of both arrays rounded to i digits
+    equal = np.round(scaled_1) == np.round(scaled_2)
+    result = np.where(equal.any(axis=0), max_digits - np.argmax(equal[::-1], axis=0), -1)
+
+    # Rounding the scaled values can differ from python's round (which rounds the exact decimal value) for
+    # values close to a tie, so these pairs are compared with round
+    ambiguous = (number_utils.near_tie(scaled_1) | number_utils.near_tie(scaled_2)).any(axis=0)
+    for i in np.flatnonzero(ambiguous):
+        # float() to use python's round instead of numpy's
+        result[i] = _round_equality(float(values_1[i]), float(values_2[i]), max_digits)
+    return result
+
+
+def _round_equality(value_1, value_2, max_digits):
     """
-    for i in reversed(range(11)):
-        try:
-            if round(row[col_1], i) == round(row[col_2], i):
-                return i
-        except ValueError:
-            return -1
-        except TypeError:
-            return -1
+    Returns the maximum rounding digits for two values to still be equal, using python's round
+    """
+    for i in reversed(range(max_digits + 1)):
+        if round(value_1, i) == round(value_2, i):
+            return i
     return -1
 
-def remove_rounding_mismatches(ca_df, columns, digits):
+def remove_rounding_mismatches(ca_df, columns, digits, comments):
     """
     Change mismatch entries for mismatches due to rounding differences
     :param ca_df:
     :param columns:
+    :param comments: CommentBuilder of ca_df
     :return:
     """
     # For each column specified, compare information from two vendors and check if they are equal after rounding to X digits
-    before = ca_df.copy()
+    changed = np.zeros(len(ca_df), dtype=bool)
     vendor_combinations = ['Reuters-EDI', 'Reuters-Plat', 'EDI-Plat']
     for col in columns:
         for vendor_comb in vendor_combinations:
             comparison_col = f'{vendor_comb}_{col}'
             vendor_1_col = f'{vendor_comb.split("-")[0]}_{col}'
             vendor_2_col = f'{vendor_comb.split("-")[1]}_{col}'
-            ca_df[comparison_col] = ca_df.apply(lambda row: max_decimal_equality(row, vendor_1_col, vendor_2_col), axis = 1)
-            ca_df[comparison_col] = ca_df[comparison_col] >= digits
+            before = ca_df[comparison_col].to_numpy()
+            after = max_decimal_equality(ca_df[vendor_1_col], ca_df[vendor_2_col]) >= digits
+            changed |= before != after
+            ca_df[comparison_col] = after
 
     # Add comment to rows that were changed
-    changes = pd.merge(before, ca_df, how='left', indicator=True)
-    changes = changes.loc[changes['_merge'] == 'left_only',]
-    ca_df.iloc[changes.index,changes.columns.get_loc('Additional Comment')] += ' Rounded'
+    comments.add(changed, 'Rounded')
 
     return ca_df
 
+def _display_values(values):
+    """
+    Formats values as printed by pandas (e.g. 2.63996 for 2.639960000001 and NaN for missing values)
+    :param values: series
+    :return: series of strings
+    """
+    if values.empty:
+        return values.astype(str)
+    values = values.astype(object).where(values.notnull(), np.nan)
+    lines = pd.Series(values.to_numpy()).to_string(index=False, header=False).split('\n')
+    return pd.Series(lines, index=values.index).str.strip()
+
+
 def platform_lookup(ca_df, plat_data):
     """
     Checks for missing platform information, if there exists a CA with a different type in the platform
     :param ca_df:
     :return:
     """
+    key = ['RIC', 'Execution Date']
     # Select missing platform data
-    missing_plat = ca_df.loc[(ca_df['Plat_GROSS'].isnull()) & (ca_df['Plat_NET'].isnull()), ]
+    missing_plat = (ca_df['Plat_GROSS'].isnull()) & (ca_df['Plat_NET'].isnull())
+    missing_keys = pd.MultiIndex.from_frame(ca_df.loc[missing_plat, key])
 
-    # Select relevant columns from platform
+    # Select relevant platform CAs for the missing keys
     plat_data = plat_data.loc[plat_data['Type'].isin(['CASH_DIVIDEND','SPECIAL_DIVIDEND'])]
-    plat_data = plat_data[['RIC', 'Type', 'Execution Date', 'Value', 'Dividend Taxation Type']]
-    plat_data['Info'] = plat_data[['RIC', 'Type', 'Dividend Taxation Type','Value']].apply(lambda row: row.to_string(), axis=1)
-
-    # Merge datasets
-    missing_plat_enriched = pd.merge(missing_plat, plat_data[['RIC', 'Execution Date', 'Info']], on=['RIC', 'Execution Date'], how='left')
-    missing_plat_enriched = missing_plat_enriched[['RIC', 'Execution Date', 'Info']]
-
-    # Assign enriched data back to ca_df
-    missing_plat_enriched = missing_plat_enriched.drop_duplicates(subset=['RIC', 'Execution Date'])
-    ca_df_enriched = pd.merge(ca_df, missing_plat_enriched, on=['RIC', 'Execution Date'], how='left')
-    # Reformat df string
-    ca_df_enriched['Info'] = ca_df_enriched['Info'].str.replace(r'\n', ',')
-    ca_df_enriched['Info'] = ca_df_enriched['Info'].str.replace('Dividend Taxation Type', 'Dividend_Taxation_Type')
-    ca_df_enriched['Info'] = ca_df_enriched['Info'][ca_df_enriched['Info'].notnull()].str.split().apply(lambda x: " : ".join(x))
-    ca_df_enriched['Info'] = ca_df_enriched['Info'].str.replace(r',', ', ')
+    plat_data = plat_data.loc[pd.MultiIndex.from_frame(plat_data[key]).isin(missing_keys)]
+    info = ('RIC : ' + plat_data['RIC'].astype(str)
+            + ', Type : ' + plat_data['Type'].astype(str)
+            + ', Dividend_Taxation_Type : ' + _display_values(plat_data['Dividend Taxation Type'])
+            + ', Value : ' + _display_values(plat_data['Value']))
+    info.index = pd.MultiIndex.from_frame(plat_data[key])
+    info = info[~info.index.duplicated()]
+
     # Add to comment column
-    ca_df_enriched.loc[ca_df_enriched['Plat_GROSS'].isnull(),'Platform_Lookup'] = ca_df_enriched['Info']
-    ca_df_enriched = ca_df_enriched.drop(columns=['Info'], axis=1)
+    ca_df['Platform_Lookup'] = pd.Series(info.reindex(missing_keys).to_numpy(), index=ca_df.index[missing_plat],
+                                         dtype=object)
 
-    return ca_df_enriched
+    return ca_df
 
-def flag_zero_divs(ca_df):
+def flag_zero_divs(ca_df, comments):
     """
     Flags zero dividends reported by Reuters with a comment
     :param ca_df:
+    :param comments: CommentBuilder of ca_df
     :return:
     """
-    ca_df.loc[(ca_df['Reuters_GROSS'] == 0) & (ca_df['Reuters_NET'] == 0), 'Additional Comment'] += ' Reuters zero dividend'
+    comments.add((ca_df['Reuters_GROSS'] == 0) & (ca_df['Reuters_NET'] == 0), 'Reuters zero dividend')
     return ca_df
 
-def analyze_datasets(reuters_data_dict, edi_data_dict, plat_data_dict, gigant_general):
-    logger.debug('Compare data from the different vendors...')
+# identifier keys
+IDENT_KEYS_NOT_CASH_DIV = ['RIC', 'Type', 'Execution Date']
+IDENT_KEYS_CASH_DIV = ['RIC', 'Type', 'Execution Date', 'Dividend Taxation Type']
 
-    # Remove duplicates in datasets
-    reuters_data_dict = remove_duplicates(reuters_data_dict)
-    edi_data_dict = remove_duplicates(edi_data_dict)
-    plat_data_dict = remove_duplicates(plat_data_dict)
+# columns of the check dataframes per CA type
+CHECK_COLUMNS = {
+    'Stock dividends': ['RIC', 'ISIN', 'TICKER', 'Name', 'Type', 'Execution Date',
+        'Reuters_Stock Dividend', 'EDI_Stock Dividend', 'Plat_Stock Dividend', 'Reuters-EDI', 'Reuters-Plat',
+        'EDI-Plat','Additional Comment'],
+    'Stock splits': ['RIC', 'ISIN', 'TICKER', 'Name', 'Type', 'Execution Date',
+        'Reuters_Relation', 'EDI_Relation','Plat_Relation',  'Reuters-EDI', 'Reuters-Plat', 'EDI-Plat',
+        'Additional Comment'],
+    'Rights issues': ['RIC', 'ISIN', 'TICKER', 'Name', 'Type', 'Execution Date', 'Reuters_Terms',
+       'Reuters_Subscription Price', 'Reuters_Currency', 'EDI_Currency', 'EDI_Terms', 'EDI_Subscription Price',
+        'Plat_Currency', 'Plat_Subscription Price', 'Plat_Terms', 'Reuters-EDI', 'Reuters-Plat', 'EDI-Plat',
+       'Additional Comment'],
+    'Cash dividends': ['RIC', 'ISIN', 'TICKER', 'Name', 'Type', 'Execution Date', 'Dividend Taxation Type', 'Reuters_GROSS',
+        'Reuters_NET','Reuters_Currency', 'EDI_GROSS', 'EDI_NET', 'EDI_Currency', 'Plat_GROSS', 'Plat_NET',
+        'Plat_Currency', 'Reuters-EDI_GROSS', 'Reuters-Plat_GROSS', 'EDI-Plat_GROSS', 'Reuters-EDI_NET',
+       'Reuters-Plat_NET', 'EDI-Plat_NET', 'Reuters-EDI_Currency', 'Reuters-Plat_Currency', 'EDI-Plat_Currency', 'Additional Comment', 'Platform_Lookup'],
+}
 
-    # Add empty columns to Reuters for subscription price and currency to allow for column-wise comparison
-    reuters_data_dict['Rights issues'].loc[:,'Subscription Price'] = None
-    reuters_data_dict['Rights issues'].loc[:,'Currency'] = None
 
-    # identifier keys
-    ident_keys_not_cash_div = ['RIC', 'Type', 'Execution Date']
-    ident_keys_cash_div = ['RIC', 'Type', 'Execution Date', 'Dividend Taxation Type']
-    # Compare Reuters, EDI and Platform
-    stock_div_check = compare_ca(dfs=[reuters_data_dict['Stock dividends'],
-                                        edi_data_dict['Stock dividends'],
-                                        plat_data_dict['Stock dividends']],
-                                   key=ident_keys_not_cash_div, gigant_general=gigant_general)
-    stock_split_check = compare_ca(dfs=[reuters_data_dict['Stock splits'],
-                                        edi_data_dict['Stock splits'],
-                                        plat_data_dict['Stock splits']],
-                                   key=ident_keys_not_cash_div, gigant_general=gigant_general)
-    rights_check = compare_ca(dfs=[reuters_data_dict['Rights issues'],
-                                   edi_data_dict['Rights issues'],
-                                   plat_data_dict['Rights issues']],
-                              key=ident_keys_not_cash_div, gigant_general=gigant_general)
-    cash_divs_check = compare_ca(dfs=[reuters_data_dict['Cash dividends'],
-                                      edi_data_dict['Cash dividends'],
-                                      plat_data_dict['Cash dividends']],
-                                 key=ident_keys_cash_div, gigant_general=gigant_general, per_column=True)
+def analyze_stock_divs(dfs, gigant_general):
+    """
+    Compares the stock dividends of Reuters, EDI and Platform
+    :param dfs: Reuters, EDI and Platform stock dividends
+    :param gigant_general:
+    :return:
+    """
+    stock_div_check = compare_ca(dfs=dfs, key=IDENT_KEYS_NOT_CASH_DIV, gigant_general=gigant_general)
+
+    # Adjust order of columns
+    return stock_div_check[CHECK_COLUMNS['Stock dividends']].sort_values(by=['RIC', 'Execution Date'])
+
+
+def analyze_stock_splits(dfs, gigant_general):
+    """
+    Compares the stock splits of Reuters, EDI and Platform
+    :param dfs: Reuters, EDI and Platform stock splits
+    :param gigant_general:
+    :return:
+    """
+    stock_split_check = compare_ca(dfs=dfs, key=IDENT_KEYS_NOT_CASH_DIV, gigant_general=gigant_general)
+
+    # Adjust order of columns
+    return stock_split_check[CHECK_COLUMNS['Stock splits']].sort_values(by=['RIC', 'Execution Date'])
+
+
+def analyze_rights(dfs, gigant_general, ice_capital_events=None):
+    """
+    Compares the rights issues of Reuters, EDI and Platform and adds the ICE event type
+    :param dfs: Reuters, EDI and Platform rights issues
+    :param gigant_general:
+    :param ice_capital_events: prefetched ICE data
+    :return:
+    """
+    rights_check = compare_ca(dfs=dfs, key=IDENT_KEYS_NOT_CASH_DIV, gigant_general=gigant_general)
+
+    # Add Event type to Rights issue
+    rights_check = add_rights_event_type(rights_check, gigant_general, ice_capital_events)
+
+    # Adjust order of columns
+    return rights_check[CHECK_COLUMNS['Rights issues']].sort_values(by=['RIC', 'Execution Date'])
+
+
+def analyze_cash_divs(dfs, gigant_general, plat_data):
+    """
+    Compares the cash dividends of Reuters, EDI and Platform and enriches them with ADR, rounding,
+    platform lookup and zero dividend information
+    :param dfs: Reuters, EDI and Platform cash dividends
+    :param gigant_general:
+    :param plat_data: raw Platform data
+    :return:
+    """
+    cash_divs_check = compare_ca(dfs=dfs, key=IDENT_KEYS_CASH_DIV, gigant_general=gigant_general, per_column=True)
 
     # Add ADR to cash dividend df
     cash_divs_check = data_import.add_adr(cash_divs_check)
 
-    # Add Event type to Rights issue
-    rights_check = add_rights_event_type(rights_check, gigant_general)
+    # Collect comments for the cash dividends, they are materialized once at the end
+    cash_div_comments = data_import.CommentBuilder(cash_divs_check['Additional Comment'])
 
     # Adjust mismatches due to rounding, add comment for changed observtions
-    cash_divs_check = remove_rounding_mismatches(cash_divs_check, columns=['GROSS', 'NET'], digits=6)
+    cash_divs_check = remove_rounding_mismatches(cash_divs_check, columns=['GROSS', 'NET'], digits=6,
+                                                 comments=cash_div_comments)
 
     # Lookup Cash/Special Dividend if no data from platform
-    cash_divs_check = platform_lookup(cash_divs_check, plat_data_dict['Raw data'])
+    cash_divs_check = platform_lookup(cash_divs_check, plat_data)
 
     # Flag cash dividends with value zero from Reuters with a comment
-    cash_divs_check = flag_zero_divs(cash_divs_check)
+    cash_divs_check = flag_zero_divs(cash_divs_check, cash_div_comments)
 
-    cash_divs_check = data_import.add_comment(cash_divs_check, ['Additional Comment_temp', 'Franking amount', 'CFI amount'])
+    cash_divs_check = data_import.add_comment(cash_divs_check, ['Additional Comment_temp', 'Franking amount', 'CFI amount'],
+                                              cash_div_comments)
 
     # Adjust order of columns
-    stock_div_check = stock_div_check[['RIC', 'ISIN', 'TICKER', 'Name', 'Type', 'Execution Date',
-        'Reuters_Stock Dividend', 'EDI_Stock Dividend', 'Plat_Stock Dividend', 'Reuters-EDI', 'Reuters-Plat',
-        'EDI-Plat','Additional Comment']].sort_values(by=['RIC', 'Execution Date'])
+    return cash_divs_check[CHECK_COLUMNS['Cash dividends']].sort_values(by=['RIC', 'Execution Date'])
 
-    stock_split_check = stock_split_check[['RIC', 'ISIN', 'TICKER', 'Name', 'Type', 'Execution Date',
-        'Reuters_Relation', 'EDI_Relation','Plat_Relation',  'Reuters-EDI', 'Reuters-Plat', 'EDI-Plat',
-        'Additional Comment']].sort_values(by=['RIC', 'Execution Date'])
 
-    rights_check = rights_check[['RIC', 'ISIN', 'TICKER', 'Name', 'Type', 'Execution Date', 'Reuters_Terms',
-       'Reuters_Subscription Price', 'Reuters_Currency', 'EDI_Currency', 'EDI_Terms', 'EDI_Subscription Price',
-        'Plat_Currency', 'Plat_Subscription Price', 'Plat_Terms', 'Reuters-EDI', 'Reuters-Plat', 'EDI-Plat',
-       'Additional Comment']].sort_values(by=['RIC', 'Execution Date'])
+def _enrichment_context(ca_type, rics, gigant_general, ice_capital_events):
+    """
+    Returns the data keyed by RIC that the checks of the CA type are enriched with
+    :param ca_type:
+    :param rics: RICs of the CAs
+    :param gigant_general:
+    :param ice_capital_events: prefetched ICE data
+    :return: list of dataframes with a RIC column
+    """
+    universe = gigant_general.get_all_instruments()
+    context = [universe.loc[universe['RIC'].isin(rics), ['RIC', 'ISIN', 'TICKER', 'Name']]]
+    if ca_type == 'Cash dividends':
+        # ADR flag, it decides between GROSS and NET in the upload
+        context.append(ca_types.fetch_symbology(pd.DataFrame({'RIC': rics}))[['RIC'] + ca_types.SYMBOLOGY_COLUMNS])
+    if ca_type == 'Rights issues' and ice_capital_events is not None:
+        event_types = gigant_general.get_ric(ice_capital_events).drop_duplicates(subset=['RIC'])
+        context.append(event_types.loc[event_types['RIC'].isin(rics), ['RIC', 'Event_type']])
+    return context
+
+
+def _select_changed_cas(dfs_per_type, plat_raw_data, state_store, gigant_general, ice_capital_events):
+    """
+    Restricts the vendor data of each CA type to the CAs whose inputs changed since they were last validated.
+    The inputs are the vendor values and the universe, symbology and ICE data the checks are enriched with
+    :param dfs_per_type: Reuters, EDI and Platform data per CA type
+    :param plat_raw_data: raw Platform data
+    :param state_store: ValidationStateStore
+    :param gigant_general:
+    :param ice_capital_events: prefetched ICE data
+    :return: vendor data of the changed CAs per CA type, raw Platform data of the changed cash dividends,
+    fingerprints of all CAs and of the changed CAs per CA type
+    """
+    fingerprints = {}
+    changed = {}
+    for ca_type, dfs in dfs_per_type.items():
+        # The platform lookup of cash dividends also depends on the raw platform data
+        vendor_dfs = dfs + ([plat_raw_data] if ca_type == 'Cash dividends' else [])
+        rics = pd.concat([df['RIC'] for df in dfs]).dropna().unique()
+        context = _enrichment_context(ca_type, rics, gigant_general, ice_capital_events)
+        fingerprints[ca_type] = validation_state.fingerprint_cas(vendor_dfs, context)
+        changed[ca_type] = state_store.changed(ca_type, fingerprints[ca_type])
+        logger.debug(f'{ca_type}: {len(changed[ca_type])} of {len(fingerprints[ca_type])} CAs changed since the last run')
+
+    dfs_per_type = {ca_type: [validation_state.select_cas(df, changed[ca_type].index) for df in dfs]
+                    for ca_type, dfs in dfs_per_type.items()}
+    plat_raw_data = validation_state.select_cas(plat_raw_data, changed['Cash dividends'].index)
+    return dfs_per_type, plat_raw_data, fingerprints, changed
+
+
+def analyze_datasets(reuters_data_dict, edi_data_dict, plat_data_dict, gigant_general, ice_capital_events=None,
+                     parallel=True, state_store=None, delta_only=False):
+    """
+    Compares the CA types of the vendors. The CA types share no intermediate state, so their comparison and
+    enrichment chains run in parallel threads, unless parallel is False (e.g. for debugging).
+    If a state store is given, only CAs whose vendor values changed since the last run are recomputed
+    :param state_store: ValidationStateStore for incremental validation
+    :param delta_only: if True, only the recomputed CAs are returned, otherwise all CAs (stored ones included)
+    :return: stock dividend, stock split, rights issue and cash dividend checks
+    """
+    logger.debug('Compare data from the different vendors...')
 
-    cash_divs_check = cash_divs_check[['RIC', 'ISIN', 'TICKER', 'Name', 'Type', 'Execution Date', 'Dividend Taxation Type', 'Reuters_GROSS',
-        'Reuters_NET','Reuters_Currency', 'EDI_GROSS', 'EDI_NET', 'EDI_Currency', 'Plat_GROSS', 'Plat_NET',
-        'Plat_Currency', 'Reuters-EDI_GROSS', 'Reuters-Plat_GROSS', 'EDI-Plat_GROSS', 'Reuters-EDI_NET',
-       'Reuters-Plat_NET', 'EDI-Plat_NET', 'Reuters-EDI_Currency', 'Reuters-Plat_Currency', 'EDI-Plat_Currency', 'Additional Comment', 'Platform_Lookup']].sort_values(by=['RIC', 'Execution Date'])
+    # Remove duplicates in datasets
+    reuters_data_dict = remove_duplicates(reuters_data_dict)
+    edi_data_dict = remove_duplicates(edi_data_dict)
+    plat_data_dict = remove_duplicates(plat_data_dict)
+
+    # Add empty columns to Reuters for subscription price and currency to allow for column-wise comparison
+    reuters_data_dict['Rights issues'].loc[:,'Subscription Price'] = None
+    reuters_data_dict['Rights issues'].loc[:,'Currency'] = None
+
+    dfs_per_type = {ca_type: [reuters_data_dict[ca_type], edi_data_dict[ca_type], plat_data_dict[ca_type]]
+                    for ca_type in CHECK_COLUMNS}
+    plat_raw_data = plat_data_dict['Raw data']
+    if state_store is not None:
+        dfs_per_type, plat_raw_data, fingerprints, changed = _select_changed_cas(dfs_per_type, plat_raw_data,
+                                                                                 state_store, gigant_general,
+                                                                                 ice_capital_events)
+
+    chains = [('Stock dividends', analyze_stock_divs, (dfs_per_type['Stock dividends'], gigant_general)),
+              ('Stock splits', analyze_stock_splits, (dfs_per_type['Stock splits'], gigant_general)),
+              ('Rights issues', analyze_rights, (dfs_per_type['Rights issues'], gigant_general, ice_capital_events)),
+              ('Cash dividends', analyze_cash_divs, (dfs_per_type['Cash dividends'], gigant_general, plat_raw_data))]
+
+    def run_chain(ca_type, chain, args):
+        # Nothing to compare, e.g. if no CA of the type changed
+        if all(df.empty for df in args[0]):
+            return pd.DataFrame(columns=CHECK_COLUMNS[ca_type])
+        return chain(*args)
+
+    if parallel:
+        with ThreadPoolExecutor(max_workers=len(chains)) as executor:
+            futures = [executor.submit(run_chain, *chain) for chain in chains]
+            # Results are gathered in the order of the chains, independent of completion order
+            results = [future.result() for future in futures]
+    else:
+        results = [run_chain(*chain) for chain in chains]
+
+    # The store is only accessed from this thread
+    if state_store is not None:
+        for (ca_type, _, _), check in zip(chains, results):
+            state_store.save(ca_type, changed[ca_type], check)
+        if not delta_only:
+            results = [state_store.load(ca_type, fingerprints[ca_type].index, CHECK_COLUMNS[ca_type])
+                       .sort_values(by=['RIC', 'Execution Date']) for ca_type, _, _ in chains]
 
+    stock_div_check, stock_split_check, rights_check, cash_divs_check = results
     return (stock_div_check, stock_split_check, rights_check, cash_divs_check)
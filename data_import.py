@@ -1,57 +1,234 @@
 import pandas as pd
+import numpy as np
 import ca_types
 from loguru import logger
 import os
+import io
+import hashlib
+import requests
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import cache_utils
+
+def hash_file(filename):
+    """
+    Returns the content hash of a file
+    :param filename:
+    :return: sha256 hex digest
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
 
-def get_reuters_data(reuters_path):
+def read_reuters_file(filename, content_hash):
     """
-    Reads all reuters files, concatenates them
+    Reads a single Reuters Eikon export. Parsed files are cached by content hash, so unchanged files
+    are read from the cache instead of being parsed again. Unreadable cache entries are parsed again
+    :param filename:
+    :param content_hash: content hash of the file
+    :return: dataframe without empty rows
     """
-    return_df = pd.DataFrame()
-    for i in os.listdir(reuters_path):
-        filename = reuters_path + r"\\" + i
+    parsed_path = cache_utils.cache_path('reuters', content_hash)
+    cur_df = cache_utils.read_frame(parsed_path)
+    if cur_df is None:
         cur_df = pd.read_excel(filename, skiprows=6).dropna(how="all")
-        if not cur_df.empty:
-            return_df = pd.concat([return_df, cur_df])
+        try:
+            cache_utils.write_frame(cur_df, parsed_path)
+        except Exception as e:
+            logger.warning(f'Could not cache parsed Reuters file {filename}: {e}')
+    return cur_df
 
-    logger.debug(f'Read Reuters data from files in: {reuters_path}')
-    return return_df.reset_index(drop=True)
+
+def prune_reuters_cache(content_hashes):
+    """
+    Removes parsed Reuters files from the cache whose content is no longer in the Reuters directory
+    :param content_hashes: content hashes of the current files
+    :return:
+    """
+    cache_dir = os.path.dirname(cache_utils.cache_path('reuters', 'manifest.json'))
+    for cache_file in os.listdir(cache_dir):
+        content_hash, extension = os.path.splitext(cache_file)
+        if extension in ('.parquet', '.pkl') and content_hash not in content_hashes:
+            os.remove(os.path.join(cache_dir, cache_file))
+            logger.debug(f'Removed cached Reuters file {cache_file}')
 
 
-def get_edi_data(start_date, end_date, edi_manual_file):
+def get_reuters_data(reuters_path, max_workers=None):
+    """
+    Reads all reuters files in a process pool, concatenates them.
+    Files that cannot be parsed are reported and skipped.
+    """
+    # Files are identified by path, size and mtime; only new or modified files are hashed again
+    manifest_path = cache_utils.cache_path('reuters', 'manifest.json')
+    # An unreadable manifest is treated like a cold cache
+    previous_manifest = cache_utils.read_json(manifest_path)
+    if not isinstance(previous_manifest, dict):
+        previous_manifest = {}
+    manifest = {}
+
+    filenames = [reuters_path + r"\\" + i for i in os.listdir(reuters_path)]
+    parsed = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        hash_futures = {}
+        for filename in filenames:
+            stat = os.stat(filename)
+            entry = previous_manifest.get(filename)
+            unchanged = entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
+            manifest[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                                  'hash': entry['hash'] if unchanged else None}
+            if not unchanged:
+                hash_futures[filename] = executor.submit(hash_file, filename)
+        for filename, future in hash_futures.items():
+            try:
+                manifest[filename]['hash'] = future.result()
+            except Exception as e:
+                logger.error(f'Could not read Reuters file {filename}: {e}')
+                del manifest[filename]
+
+        # Each content is parsed once, also if several files share it, so no two workers write the same cache entry
+        files_per_hash = {}
+        for filename, entry in manifest.items():
+            files_per_hash.setdefault(entry['hash'], []).append(filename)
+        read_futures = {content_hash: executor.submit(read_reuters_file, files[0], content_hash)
+                        for content_hash, files in files_per_hash.items()}
+        for content_hash, future in read_futures.items():
+            try:
+                parsed[content_hash] = future.result()
+            except Exception as e:
+                logger.error(f'Could not read Reuters file {files_per_hash[content_hash][0]}: {e}')
+                for filename in files_per_hash[content_hash]:
+                    del manifest[filename]
+
+    cache_utils.write_json(manifest, manifest_path)
+    prune_reuters_cache({entry['hash'] for entry in manifest.values()})
+
+    frames = [parsed[manifest[filename]['hash']] for filename in filenames
+              if filename in manifest and not parsed[manifest[filename]['hash']].empty]
+    logger.debug(f'Read Reuters data from {len(frames)} files in: {reuters_path}')
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+EDI_API_URL = 'http://XYZ/v1/ca'
+EDI_API_TIMEOUT = 300
+
+EDI_COLUMN_MAPPING = {
+    "ID_RIC": "RIC",
+    "EVENT_TYPE": "Type",
+    "EX_DT": "Execution Date",
+    "STOCK_SPLIT_RATIO": "Relation",
+    "GROSS_AMT": "GROSS",
+    "NET_AMT": "NET",
+    "STOCK_DIV_RATIO": "Stock Dividend",
+    "REPORTED_AMT": "REPORTED_AMT",
+    "SUBSCRIPTION_RATIO": "Terms",
+    "CRNCY": "Currency",
+    "SUBSCRIPTION_PRICE": "Subscription Price",
+    "SUBSCRIPTION_PRICE_CRNCY": "Subscription Currency",
+    "SOURCE": "Source",
+    "TAX_RATE": "Tax Rate"
+}
+
+# Ratios can be numbers or "a:b" strings, so they are read as strings and parsed by EdiCAs
+EDI_DTYPES = {
+    "ID_RIC": str,
+    "EVENT_TYPE": str,
+    "EX_DT": str,
+    "STOCK_SPLIT_RATIO": str,
+    "GROSS_AMT": 'float64',
+    "NET_AMT": 'float64',
+    "STOCK_DIV_RATIO": str,
+    "REPORTED_AMT": 'float64',
+    "SUBSCRIPTION_RATIO": str,
+    "CRNCY": str,
+    "SUBSCRIPTION_PRICE": 'float64',
+    "SUBSCRIPTION_PRICE_CRNCY": str,
+    "SOURCE": str,
+    "TAX_RATE": 'float64'
+}
+
+
+def fetch_edi_feed():
     """
-    Fetches EDI data from EDI API or from EDI.csv, if specified
+    Downloads the EDI feed from the API into the local cache. The cached copy is revalidated with
+    If-None-Match/If-Modified-Since and only downloaded again, if the feed changed on the server
+    :return: path of the cached feed
+    """
+    feed_path = cache_utils.cache_path('edi', 'EDI.csv')
+    validators_path = feed_path + '.json'
+    headers = {'Accept-Encoding': 'gzip'}
+    if os.path.exists(feed_path) and os.path.exists(validators_path):
+        # Unreadable validators are ignored, the feed is then downloaded unconditionally
+        validators = cache_utils.read_json(validators_path)
+        if not isinstance(validators, dict):
+            validators = {}
+        if validators.get('ETag'):
+            headers['If-None-Match'] = validators['ETag']
+        if validators.get('Last-Modified'):
+            headers['If-Modified-Since'] = validators['Last-Modified']
+
+    # Failed requests are raised: the cached copy is only used if the server confirms it is current (304)
+    with requests.get(EDI_API_URL, headers=headers, stream=True, timeout=EDI_API_TIMEOUT) as response:
+        if response.status_code == 304:
+            logger.debug('EDI feed not modified since last download, using cached copy')
+            return feed_path
+        response.raise_for_status()
+        # iter_content decodes the gzip transfer encoding
+        try:
+            with open(feed_path + '.part', 'wb') as f:
+                for block in response.iter_content(chunk_size=1 << 20):
+                    f.write(block)
+            os.replace(feed_path + '.part', feed_path)
+        finally:
+            if os.path.exists(feed_path + '.part'):
+                os.remove(feed_path + '.part')
+        cache_utils.write_json({'ETag': response.headers.get('ETag'),
+                                'Last-Modified': response.headers.get('Last-Modified')}, validators_path)
+
+    return feed_path
+
+
+def get_edi_source(edi_manual_file):
+    """
+    Returns the local path of the EDI data: EDI/EDI.csv, if specified, otherwise the cached API feed
+    :param edi_manual_file:
     :return:
     """
     if edi_manual_file:
         local_edi_dir = os.getcwd() + '\\EDI\\EDI.csv'
         logger.debug(f'Fetching EDI data from {local_edi_dir}...')
-        df = pd.read_csv(local_edi_dir)
+        return local_edi_dir
+    logger.debug('Fetching EDI data from API...')
+    return fetch_edi_feed()
+
+
+def get_edi_data(start_date, end_date, edi_manual_file, chunksize=200000):
+    """
+    Fetches EDI data from EDI API or from EDI.csv, if specified.
+    The feed is streamed in chunks: only mapped columns are read and only rows within the date window are kept.
+    :return:
+    """
+    source = get_edi_source(edi_manual_file)
+
+    start_date = pd.Timestamp(start_date)
+    end_date = pd.Timestamp(end_date)
+    chunks = []
+    for chunk in pd.read_csv(source, usecols=lambda col: col in EDI_COLUMN_MAPPING, dtype=EDI_DTYPES,
+                             chunksize=chunksize):
+        ex_dates = pd.to_datetime(chunk['EX_DT'])
+        in_window = (ex_dates >= start_date) & (ex_dates <= end_date)
+        if in_window.any():
+            chunks.append(chunk.loc[in_window].assign(EX_DT=ex_dates[in_window]))
+
+    if chunks:
+        df = pd.concat(chunks, ignore_index=True)
     else:
-        logger.debug('Fetching EDI data from API...')
-        df = pd.read_csv('http://XYZ/v1/ca')
-    column_mapping = {
-        "ID_RIC": "RIC",
-        "EVENT_TYPE": "Type",
-        "EX_DT": "Execution Date",
-        "STOCK_SPLIT_RATIO": "Relation",
-        "GROSS_AMT": "GROSS",
-        "NET_AMT": "NET",
-        "STOCK_DIV_RATIO": "Stock Dividend",
-        "REPORTED_AMT": "REPORTED_AMT",
-        "SUBSCRIPTION_RATIO": "Terms",
-        "CRNCY": "Currency",
-        "SUBSCRIPTION_PRICE": "Subscription Price",
-        "SUBSCRIPTION_PRICE_CRNCY": "Subscription Currency",
-        "SOURCE": "Source",
-        "TAX_RATE": "Tax Rate"
-    }
-    df = df.drop(columns=df.columns.difference(column_mapping))
-    df = df.rename(columns=column_mapping)
-    df['Execution Date'] = pd.to_datetime(df['Execution Date'])
-    df = df[df['Execution Date'] >= start_date]
-    df = df[df['Execution Date'] <= end_date]
-    df.reset_index(inplace=True, drop=True, )
+        df = pd.DataFrame(columns=list(EDI_COLUMN_MAPPING)).astype({'EX_DT': 'datetime64[ns]'})
+    df = df.rename(columns=EDI_COLUMN_MAPPING)
 
     return df
 
@@ -169,9 +346,53 @@ def add_reit(cash_div_df: pd.DataFrame):
     cash_div_df = cash_div_df.drop(columns=['SECURITY_TYP_2', 'SECURITY_TYP', 'Dividend Taxation Type_temp', 'Exchange'])
     return cash_div_df
 
-def add_comment(cash_div_df: pd.DataFrame, comment_adding_columns: list):
-    cash_div_df['Additional Comment'] = cash_div_df[['Additional Comment']+comment_adding_columns].apply(
-        lambda x: ", ".join(x.astype(str).replace('nan', '')).strip(', ').replace(' , ', ' '), axis=1)
+class CommentBuilder:
+    """
+    Collects comments for the rows of a dataframe and materializes them once as a single comment column.
+    Flag comments are appended to the base comment separated by a space, comment columns are then joined with ', '
+    """
+    def __init__(self, base_comments: pd.Series):
+        self.index = base_comments.index
+        self.base_comments = base_comments.astype(str).to_numpy(dtype=object)
+        self.columns = []
+
+    def add(self, mask, comment):
+        """
+        Appends a comment to the base comment of the rows selected by the boolean mask
+        """
+        if isinstance(mask, pd.Series):
+            mask = mask.reindex(self.index, fill_value=False)
+        self.base_comments = np.where(np.asarray(mask, dtype=bool), self.base_comments + ' ' + comment,
+                                      self.base_comments)
+
+    def add_column(self, comments: pd.Series):
+        """
+        Adds a column of comments, missing entries are left empty
+        """
+        self.columns.append(comments.reindex(self.index).astype(str).replace('nan', ''))
+
+    def build(self):
+        """
+        Joins the base comment and the comment columns of each row, without leading, trailing or empty entries
+        :return: series of comments
+        """
+        comments = pd.Series(self.base_comments, index=self.index, dtype=object)
+        if self.columns:
+            comments = comments.str.cat(self.columns, sep=', ')
+        return comments.str.strip(', ').str.replace(' , ', ' ', regex=False)
+
+
+def add_comment(cash_div_df: pd.DataFrame, comment_adding_columns: list, comments: CommentBuilder):
+    """
+    Materializes the collected comments and the comment columns as Additional Comment
+    :param cash_div_df:
+    :param comment_adding_columns: columns that are appended to the comment and dropped afterwards
+    :param comments: comments collected during the analysis
+    :return:
+    """
+    for col in comment_adding_columns:
+        comments.add_column(cash_div_df[col])
+    cash_div_df['Additional Comment'] = comments.build()
 
     cash_div_df = cash_div_df.drop(columns=comment_adding_columns)
     return cash_div_df
@@ -207,25 +428,112 @@ def keep_gigant_instruments(ca_df, gigant_general):
     ca_df_in_gigant = ca_df.loc[ca_df['RIC'].isin(gigant_instruments['RIC']),]
     return ca_df_in_gigant
 
-def fetch_all_data(start_date, end_date, gigant_general, edi_manual_file):
+REUTERS_PATH = r'T:\EquityOps\Rundeck\VENDOR_CA_VALIDATION\REUTERS FILES'
+# r'C:\Users\EquityOpsShared\Desktop\EIKON OUTPUT FILE-CA'
+ICE_CAPITAL_EVENTS_URL = 'XYZ/ice-equity-ca/rest/v1/corporate-action/instruments?event_type=CapitalEvents'
+
+# Seconds after the start of the acquisition until a source counts as failed
+SOURCE_TIMEOUTS = {'universe': 600, 'reuters': 900, 'edi': 900, 'platform': 900, 'ice': 300, 'symbology': 900}
+# Sources that are fetched again when needed, if their acquisition failed
+OPTIONAL_SOURCES = ['ice', 'symbology']
+
+
+def get_ice_capital_events():
+    """
+    Fetches the capital event types from ICE
+    :return:
+    """
+    # Download with a timeout before parsing, pd.read_csv would wait on the URL indefinitely
+    response = requests.get(ICE_CAPITAL_EVENTS_URL, timeout=SOURCE_TIMEOUTS['ice'])
+    response.raise_for_status()
+    ice_capital_events_data = pd.read_csv(io.StringIO(response.text))
+    return ice_capital_events_data[['ISIN', 'Event_type', 'MIC', 'SEDOL']]
+
+
+def prefetch_symbology(edi_future, universe_future):
     """
-    Fetches the data from Reuters, EDI, and Platform and returns a data dictionariy with the CA type datasets
-    for each vendor
+    Warms the symbology cache for the EDI cash dividends in the universe, as soon as both are available
+    :param edi_future:
+    :param universe_future:
+    :return:
+    """
+    edi_data = edi_future.result(timeout=SOURCE_TIMEOUTS['edi'])
+    universe = universe_future.result(timeout=SOURCE_TIMEOUTS['universe'])
+    edi_cash = edi_data.loc[edi_data['Type'].str.contains('CASH_DIVIDEND|SPECIAL_DIVIDEND', na=False)]
+    return ca_types.fetch_symbology(keep_gigant_instruments(edi_cash, universe))
+
+
+def acquire_sources(start_date, end_date, edi_manual_file, plat_snapshot=False):
+    """
+    Fetches the universe, Reuters, EDI, Platform and ICE data concurrently. Each source has its own timeout,
+    a failing source does not stop the others. Only failures of required sources raise an error.
     :param start_date:
     :param end_date:
+    :param edi_manual_file: if True, use EDI/EDI.csv instead of the API
+    :param plat_snapshot: if True, reuse a local snapshot of the Platform CAs for the same date window
+    :return: dict with the data of each source, None for failed optional sources
+    """
+    executor = ThreadPoolExecutor(max_workers=len(SOURCE_TIMEOUTS))
+    started = time.monotonic()
+    futures = {'universe': executor.submit(ca_types.Gigant_Generell_Information),
+               'reuters': executor.submit(get_reuters_data, REUTERS_PATH),
+               'edi': executor.submit(get_edi_data, start_date, end_date, edi_manual_file),
+               'platform': executor.submit(ca_types.GigantCAs, start_date, end_date, snapshot=plat_snapshot),
+               'ice': executor.submit(get_ice_capital_events)}
+    futures['symbology'] = executor.submit(prefetch_symbology, futures['edi'], futures['universe'])
+
+    sources = {}
+    failed = []
+    for name, future in futures.items():
+        remaining = started + SOURCE_TIMEOUTS[name] - time.monotonic()
+        try:
+            sources[name] = future.result(timeout=max(remaining, 0))
+            logger.debug(f'Fetched {name} data after {time.monotonic() - started:.1f}s')
+        except Exception as e:
+            logger.error(f'Fetching {name} data failed: {e!r}')
+            sources[name] = None
+            if name not in OPTIONAL_SOURCES:
+                failed.append(name)
+    # Do not block on fetches that timed out. The underlying requests and database reads have their own
+    # timeouts, so their threads end and do not keep the process alive at exit
+    executor.shutdown(wait=False)
+
+    if failed:
+        raise RuntimeError(f'Could not fetch data from: {", ".join(failed)}')
+    return sources
+
+
+def select_window(data_dict, start_date, end_date):
+    """
+    Restricts the datasets of a data dictionary to CAs with an execution date within the window
+    :param data_dict:
+    :param start_date:
+    :param end_date:
+    :return: new data dictionary
+    """
+    start_date = pd.Timestamp(start_date)
+    end_date = pd.Timestamp(end_date)
+    return {name: df.loc[(df['Execution Date'] >= start_date) & (df['Execution Date'] <= end_date)]
+            for name, df in data_dict.items()}
+
+
+def fetch_all_data(start_date, end_date, gigant_general, sources):
+    """
+    Builds the CA type datasets for each vendor from the acquired source data and returns them as data dictionaries
+    :param start_date:
+    :param end_date:
+    :param gigant_general: instrument universe
+    :param sources: source data from acquire_sources
     :return:
     """
-    # Get data from the different sources
-    # r'C:\Users\EquityOpsShared\Desktop\EIKON OUTPUT FILE-CA'
-    reuters_data = get_reuters_data(r'T:\EquityOps\Rundeck\VENDOR_CA_VALIDATION\REUTERS FILES')
-    edi_data = get_edi_data(start_date, end_date, edi_manual_file)
-    logger.debug('Fetch Platform data from API...')
-    plat_data = ca_types.GigantCAs(start_date, end_date).df
+    # The raw source frames are taken out of sources, so they can be released once the datasets are built
+    reuters_data = sources.pop('reuters')
+    edi_data = sources.pop('edi')
+    plat_cas = sources.pop('platform')
 
     # Initialize CA classes for the different vendors
     reuters_cas = ca_types.ReutersCAs(reuters_data, start_date, end_date)
     edi_cas = ca_types.EdiCAs(edi_data, start_date, end_date)
-    plat_cas = ca_types.GigantCAs(start_date, end_date)
 
     # Filter CAs, to only keep CAs from stocks in the universe
     reuters_cas.df = keep_gigant_instruments(reuters_cas.df, gigant_general)
@@ -237,13 +545,21 @@ def fetch_all_data(start_date, end_date, gigant_general, edi_manual_file):
     reuters_rights, edi_rights, plat_rights = get_rights_issues(reuters_cas, edi_cas, plat_cas)
     reuters_cash_divs, edi_cash_divs, plat_cash_divs = get_cash_dividends(reuters_cas, edi_cas, plat_cas)
 
-    # Store different datasets in dictionaries
-    reuters_data_dict = {'Raw data': reuters_data, 'Stock dividends': reuters_stock_divs, 'Stock splits': reuters_splits,
+    # Only the Platform cash and special dividends are needed later on (platform lookup), other raw data is released
+    plat_data = plat_cas.df.loc[plat_cas.df['Type'].isin(['CASH_DIVIDEND', 'SPECIAL_DIVIDEND']),
+                                ['RIC', 'Type', 'Execution Date', 'Value', 'Dividend Taxation Type']]
+    del reuters_data, edi_data, reuters_cas, edi_cas, plat_cas
+
+    # Store different datasets in dictionaries, cast to the compact CA schema
+    reuters_data_dict = {'Stock dividends': reuters_stock_divs, 'Stock splits': reuters_splits,
                          'Rights issues': reuters_rights, 'Cash dividends': reuters_cash_divs}
-    edi_data_dict = {'Raw data': edi_data, 'Stock dividends': edi_stock_divs, 'Stock splits': edi_splits,
+    edi_data_dict = {'Stock dividends': edi_stock_divs, 'Stock splits': edi_splits,
                          'Rights issues': edi_rights, 'Cash dividends': edi_cash_divs}
-    plat_data_dict = {'Raw data': plat_data, 'Stock dividends': plat_stock_divs, 'Stock splits': plat_splits,
+    plat_data_dict = {'Stock dividends': plat_stock_divs, 'Stock splits': plat_splits,
                          'Rights issues': plat_rights, 'Cash dividends': plat_cash_divs}
-
+    for data_dict in [reuters_data_dict, edi_data_dict, plat_data_dict]:
+        for ca_type in data_dict:
+            data_dict[ca_type] = ca_types.apply_schema(data_dict[ca_type])
+    plat_data_dict['Raw data'] = ca_types.apply_schema(plat_data)
 
     return (reuters_data_dict, edi_data_dict, plat_data_dict)
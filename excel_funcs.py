@@ -1,11 +1,29 @@
 import pandas as pd
+import xlsxwriter
+from xlsxwriter.utility import xl_range
 from loguru import logger
 
+CA_SHEETS = ['Stock Dividends', 'Stock Splits', 'Rights Issues', 'Cash Dividends']
+# Check columns compare two vendors, e.g. Reuters-EDI or Reuters-EDI_GROSS
+CHECK_COLUMN_PREFIXES = ['Reuters-EDI', 'Reuters-Plat', 'EDI-Plat']
+# Number of rows converted at once when streaming a sheet
+STREAM_CHUNK_SIZE = 10000
 
-def color_code_checks(wb):
+
+def check_columns(df):
+    """
+    Returns the positions of the vendor check columns (TRUE/FALSE)
+    :param df:
+    :return:
     """
-    Adds color coding to the check columns
+    return [i for i, col in enumerate(df.columns) if col.split('_')[0] in CHECK_COLUMN_PREFIXES]
+
+
+def color_code_checks(wb, dfs):
+    """
+    Adds color coding to the check columns. The formatting only covers the rows with data
     :param wb:
+    :param dfs: dataframes of the CA sheets
     :return:
     """
     # Define formats
@@ -15,41 +33,54 @@ def color_code_checks(wb):
                                    'font_color': '#006100'})
     format_default = wb.add_format()
 
-    # Define sheet area to apply styling to
-    area = 'A1:AZ50000'
+    for sheet, df in zip(CA_SHEETS, dfs):
+        columns = check_columns(df)
+        if df.empty or not columns:
+            continue
+        worksheet = wb.get_worksheet_by_name(sheet)
+
+        # Define sheet area to apply styling to: data rows of the check columns
+        area = ' '.join(xl_range(1, col, len(df), col) for col in columns)
+        first_col = columns[0]
 
-    for worksheet in wb.worksheets():
         # Remove formatting from blank cells
-        worksheet.conditional_format(area, {'type': 'blanks',
-                                                  'stop_if_true' : True,
-                                                  'format': format_default})
+        worksheet.conditional_format(1, first_col, len(df), first_col, {'type': 'blanks',
+                                                                        'stop_if_true' : True,
+                                                                        'format': format_default,
+                                                                        'multi_range': area})
         # Format 'FALSE' cells
-        worksheet.conditional_format(area, {'type': 'cell',
-                                            'criteria': 'equal to',
-                                            'value': 'FALSE',
-                                            'format': format_red})
+        worksheet.conditional_format(1, first_col, len(df), first_col, {'type': 'cell',
+                                                                        'criteria': 'equal to',
+                                                                        'value': 'FALSE',
+                                                                        'format': format_red,
+                                                                        'multi_range': area})
         # Format 'TRUE' cells
-        worksheet.conditional_format(area, {'type': 'cell',
-                                             'criteria': 'equal to',
-                                             'value': 'TRUE',
-                                             'format': format_green})
+        worksheet.conditional_format(1, first_col, len(df), first_col, {'type': 'cell',
+                                                                        'criteria': 'equal to',
+                                                                        'value': 'TRUE',
+                                                                        'format': format_green,
+                                                                        'multi_range': area})
 
     return None
 
 
-def highlight_special_exchanges(wb):
+def highlight_special_exchanges(wb, cash_divs_check):
     """
     Highlights special exchanges that need to be treated carefully in the Cash Dividends sheet
     :param wb:
+    :param cash_divs_check: dataframe of the Cash Dividends sheet
     :return:
     """
+    if cash_divs_check.empty:
+        return None
+
     # Define formats
     format_orange = wb.add_format({'bg_color': '#E26B0A'})
     format_blue = wb.add_format({'bg_color': '#00B0F0'})
     format_default = wb.add_format()
 
-    # Define area to apply formatting to
-    area = 'A1:A50000'
+    # Define area to apply formatting to: RICs of the data rows
+    area = xl_range(1, 0, len(cash_divs_check), 0)
 
     worksheet = wb.get_worksheet_by_name('Cash Dividends')
 
@@ -75,14 +106,12 @@ def highlight_special_exchanges(wb):
     return None
 
 
-def add_VBA(writer):
+def add_VBA(workbook):
     """
     Adds VBA project stored in the same directory as vbaProject.bin to the project and adds buttons for the macros
-    :param writer:
+    :param workbook: macro-enabled workbook (.xlsm)
     :return:
     """
-    workbook = writer.book
-    workbook.filename = 'CA_check.xlsm'
     workbook.add_vba_project('./vbaProject.bin')
     worksheet = workbook.get_worksheet_by_name('Upload Sheet')
     worksheet.insert_button('U3', {'macro': 'Create_UploadSheet.Create_UploadSheet',
@@ -100,20 +129,19 @@ def add_VBA(writer):
     return None
 
 
-def add_blacklist_sheet(writer):
-    pd.DataFrame().to_excel(writer, sheet_name='BL', index=False)
+def add_blacklist_sheet(workbook):
+    workbook.add_worksheet('BL')
 
 
-def add_ca_sheet(writer, end_date):
+def add_ca_sheet(workbook, end_date):
     """
     Adding a sheet with a new struct-query for corporate actions, so they can check afterwards
-    :param writer: excel writer object for storing new sheets
+    :param workbook: workbook for storing new sheets
     :param end_date: date for CAs
     :return:
     """
-    ca_after_check = pd.DataFrame([''])
-    ca_after_check.iloc[0,0] = f'=STRUCQUERY("corporateActions","","{end_date}","","","")'
-    ca_after_check.to_excel(writer, sheet_name='CAs', index=False, header=False)
+    worksheet = workbook.add_worksheet('CAs')
+    worksheet.write_formula(0, 0, f'=STRUCQUERY("corporateActions","","{end_date}","","","")')
 
 def add_manual_handling_columns(stock_div_check, stock_split_check,rights_check,cash_divs_check):
     """
@@ -138,55 +166,84 @@ def move_cols_back(df, cols_at_end):
     df = df[[c for c in df if c not in cols_at_end] + [c for c in cols_at_end if c in df]]
     return df
 
-def get_col_widths(df):
-    # First we find the maximum length of the index column
-    idx_max = max([len(str(s)) for s in df.index.values] + [len(str(df.index.name))])
-    # Then, we concatenate this to the max of the lengths of column name and its values for each column, left to right
-    return [idx_max] + [max([len(str(s)) for s in df[col].values] + [len(col)]) for col in df.columns]
+def get_value_width(values):
+    """
+    Returns the length of the longest value as displayed in the sheet. Dates, booleans and integers are
+    estimated from their dtype, other values are measured vectorized
+    :param values: series
+    :return:
+    """
+    if values.empty:
+        return 0
+    if pd.api.types.is_datetime64_any_dtype(values):
+        # yyyy/mm/dd
+        return 10
+    if pd.api.types.is_bool_dtype(values):
+        return 5
+    if pd.api.types.is_integer_dtype(values):
+        return max(len(str(values.min())), len(str(values.max())))
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Only the categories need to be measured
+        values = pd.Series(values.cat.remove_unused_categories().cat.categories)
+        return int(values.astype(str).str.len().max()) if values.size else 0
+    return int(values.astype(str).str.len().max())
+
+
+def get_col_widths(df, index=True):
+    """
+    Returns the maximum of the lengths of column name and values for each column, left to right
+    :param df:
+    :param index: if True, the width of the index comes first
+    :return: list of widths
+    """
+    widths = [max(get_value_width(df[col]), len(str(col))) for col in df.columns]
+    if index:
+        widths = [max(get_value_width(df.index.to_series()), len(str(df.index.name)))] + widths
+    return widths
 
 
-def format_file(wb, dfs):
-    # Left align all columns of CA sheets
-    relevant_sheets = ["Stock Dividends", "Stock Splits", "Rights Issues", "Cash Dividends"]
-    left_format = wb.add_format()
-    left_format.set_align('left')
-    for sheet in relevant_sheets:
-        ws = wb.get_worksheet_by_name(sheet)
-        ws.set_row(0, None, left_format)
+def format_sheet(ws, df, left_format):
+    """
+    Formats a CA sheet. Row formats have to be set before the rows are written
+    :param ws: empty worksheet
+    :param df: dataframe of the sheet
+    :param left_format:
+    :return:
+    """
+    # Left align the header
+    ws.set_row(0, None, left_format)
 
     # Expand Identifiers
-    for j,df in enumerate(dfs):
-        df = df.iloc[:,:3]
-        for i, width in enumerate(get_col_widths(df)[1:]):
-            ws = wb.get_worksheet_by_name(relevant_sheets[j])
-            ws.set_column(i, i, width+1)
+    for i, width in enumerate(get_col_widths(df.iloc[:,:3], index=False)):
+        ws.set_column(i, i, width+1)
 
     # Set Zoom
-    all_sheets = ['Stock Dividends', 'Stock Splits', 'Rights Issues', 'Cash Dividends', 'Upload Sheet', 'BL', 'CAs']
-    for sheet in relevant_sheets:
-        ws = wb.get_worksheet_by_name(sheet)
-        ws.set_zoom(85)
-
-    # Set TRUE/FALSE columns to a width of 5
-    # Sheets that only have 3 columns
-    single_sheets = ['Stock Dividends', 'Stock Splits', 'Rights Issues']
-    col_names = ['Reuters-EDI', 'Reuters-Plat', 'EDI-Plat']
-    for i, sheet in enumerate(single_sheets):
-        df = dfs[i]
-        ws = wb.get_worksheet_by_name(sheet)
-        for col_name in col_names:
-            col_index = df.columns.get_loc(col_name)
-            ws.set_column(col_index, col_index, 6)
-    # Cash Dividend Sheet
-    col_names = ['Reuters-EDI_GROSS', 'Reuters-Plat_GROSS',	'EDI-Plat_GROSS', 'Reuters-EDI_NET', 'Reuters-Plat_NET',
-                 'EDI-Plat_NET', 'Reuters-EDI_Currency', 'Reuters-Plat_Currency', 'EDI-Plat_Currency']
-    df = dfs[3]
-    ws = wb.get_worksheet_by_name('Cash Dividends')
-    for col_name in col_names:
-        col_index = df.columns.get_loc(col_name)
+    ws.set_zoom(85)
+
+    # Set TRUE/FALSE columns to a width of 6
+    for col_index in check_columns(df):
         ws.set_column(col_index, col_index, 6)
 
-def create_excel(stock_div_check, stock_split_check,rights_check,cash_divs_check, end_date):
+
+def write_rows(ws, df, header_format, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Writes the header and the rows of a dataframe in order, so they can be streamed to disk.
+    The values are converted chunk-wise to python objects with missing values as empty cells
+    :param ws:
+    :param df:
+    :param header_format:
+    :param chunk_size:
+    :return:
+    """
+    ws.write_row(0, 0, df.columns, header_format)
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size].astype(object)
+        chunk = chunk.where(chunk.notnull(), None)
+        for offset, row in enumerate(chunk.to_numpy().tolist()):
+            ws.write_row(start + offset + 1, 0, row)
+
+
+def create_excel(stock_div_check, stock_split_check,rights_check,cash_divs_check, end_date, filename='CA_check.xlsm'):
     # Create empty upload file
     upload_sheet = pd.DataFrame(
         columns=['Financial Instrument Ric*', 'TYPE*', 'Execution Date*', 'Pay Date', 'Is Ad Hoc*', 'CURRENCY*', 'VALUE',
@@ -196,35 +253,31 @@ def create_excel(stock_div_check, stock_split_check,rights_check,cash_divs_check
     # Add empty and rearrange some existing columns
     add_manual_handling_columns(stock_div_check, stock_split_check, rights_check, cash_divs_check)
     cash_divs_check = move_cols_back(cash_divs_check, ['Platform_Lookup', 'Comment'])
+    dfs = [stock_div_check, stock_split_check, rights_check, cash_divs_check]
 
-    # Create basic file structure
-    writer = pd.ExcelWriter(f'CA_check.xlsx', engine='xlsxwriter', datetime_format='yyyy/mm/dd')
-    stock_div_check.to_excel(writer, sheet_name='Stock Dividends', index=False)
-    stock_split_check.to_excel(writer, sheet_name='Stock Splits', index=False)
-    rights_check.to_excel(writer, sheet_name='Rights Issues', index=False)
-    cash_divs_check.to_excel(writer, sheet_name='Cash Dividends', index=False)
-    upload_sheet.to_excel(writer, sheet_name='Upload Sheet', index=False)
+    # Create basic file structure, rows are streamed to disk in constant memory mode
+    wb = xlsxwriter.Workbook(filename, {'constant_memory': True, 'default_date_format': 'yyyy/mm/dd'})
+    header_format = wb.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    left_format = wb.add_format({'align': 'left'})
+    for sheet, df in zip(CA_SHEETS, dfs):
+        ws = wb.add_worksheet(sheet)
+        format_sheet(ws, df, left_format)
+        write_rows(ws, df, header_format)
+    write_rows(wb.add_worksheet('Upload Sheet'), upload_sheet, header_format)
 
-    add_blacklist_sheet(writer)
-    add_ca_sheet(writer, end_date)
-
-    # Enhance excel file
-    wb = writer.book
+    add_blacklist_sheet(wb)
+    add_ca_sheet(wb, end_date)
 
     # Color code vendor checks (TRUE/FALSE)
-    color_code_checks(wb)
+    color_code_checks(wb, dfs)
 
     # Highlight certain exchanges in Cash Dividend file
-    highlight_special_exchanges(wb)
+    highlight_special_exchanges(wb, cash_divs_check)
 
     # Add VBA macro to Excel file
-    add_VBA(writer)
-
-    # Format file
-    format_file(wb, [stock_div_check, stock_split_check, rights_check, cash_divs_check])
+    add_VBA(wb)
 
     # Save file
-    writer.save()
+    wb.close()
 
     logger.debug('File successfully created!')
-
@@ -1,9 +1,10 @@
+import argparse
 import datetime
 import data_import
 import data_analysis
-import ca_types
-import excel_funcs
+import output_sinks
 import upload_process
+import validation_state
 import pandas as pd
 
 pd.set_option('mode.chained_assignment', None)
@@ -26,21 +27,39 @@ def get_dates(start_t, end_t):
     return start_date, end_date
 
 
-def main():
-    # Get start and end date
-    start_date, end_date = get_dates(0, 2)
+def get_windows(start_date, end_date, window):
+    """
+    Returns the comparison windows of a backfill: one window per business day, spanning window further business days
+    :param start_date:
+    :param end_date:
+    :param window: number of business days after the day that belong to its window
+    :return: list of (start date, end date) in isoformat
+    """
+    days = pd.bdate_range(start_date, end_date)
+    return [(day.date().isoformat(), (day + pd.tseries.offsets.BDay(window)).date().isoformat()) for day in days]
 
-    # Create instance of Gigant ICE data to be used later on
-    gigant_instance = ca_types.Gigant_Generell_Information()
 
-    # Fetch all data from Reuters, EDI and Platform
-    # Set to True, if you want to use EDI.csv file instead of API (located in dir: EDI/EDI.csv)
-    edi_manual_file = False
+def combine_checks(checks_per_window):
+    """
+    Combines the checks of all windows into one check per CA type. CAs in overlapping windows are kept once
+    :param checks_per_window: list of (stock div, stock split, rights, cash div) checks
+    :return:
+    """
+    keys = [data_analysis.IDENT_KEYS_NOT_CASH_DIV] * 3 + [data_analysis.IDENT_KEYS_CASH_DIV]
+    return tuple(pd.concat(checks, ignore_index=True).drop_duplicates(subset=key)
+                 for checks, key in zip(zip(*checks_per_window), keys))
 
-    reuters_data_dict, edi_data_dict, plat_data_dict = data_import.fetch_all_data(start_date, end_date, gigant_instance, edi_manual_file)
 
-    # Compare Reuters, EDI and Platform
-    stock_div_check, stock_split_check, rights_check, cash_divs_check = data_analysis.analyze_datasets(reuters_data_dict, edi_data_dict, plat_data_dict, gigant_instance)
+def write_output(checks, end_date, name, sinks):
+    """
+    Adds the upload columns to the checks and writes them to all output sinks
+    :param checks: stock div, stock split, rights and cash div checks
+    :param end_date:
+    :param name: name of the run, e.g. CA_check
+    :param sinks: output sinks
+    :return:
+    """
+    stock_div_check, stock_split_check, rights_check, cash_divs_check = checks
 
     # Add upload columns
     stock_div_upload = upload_process.add_stock_div_upload_cols(stock_div_check)
@@ -48,12 +67,109 @@ def main():
     rights_upload = upload_process.add_rights_upload_cols(rights_check)
     cash_divs_upload = upload_process.add_cash_div_upload_cols(cash_divs_check)
 
-    # Create Excel file
-    excel_funcs.create_excel(stock_div_upload, stock_split_upload, rights_upload, cash_divs_upload, end_date)
+    # Write Excel file and other outputs from the same frames
+    for sink in sinks:
+        sink.write([stock_div_upload, stock_split_upload, rights_upload, cash_divs_upload], end_date, name)
+
+
+def main(start_date=None, end_date=None, window=0, combined=False, incremental=False, delta_only=False,
+         output_formats=('excel',), output_dir='.'):
+    """
+    Validates the CAs from today to t+2. If a start and end date are given, the range is backfilled:
+    all sources are loaded once for the range and the CAs are compared per business day window
+    :param start_date: first day of the backfill (YYYY-MM-DD)
+    :param end_date: last day of the backfill (YYYY-MM-DD)
+    :param window: number of further business days compared with each backfill day
+    :param combined: if True, one combined file is created for the backfill instead of one file per day
+    :param incremental: if True, only CAs whose vendor values changed since the last run are recomputed
+    (validated CAs are stored in dir: cache/state)
+    :param delta_only: if True, the incremental output only contains the recomputed CAs
+    :param output_formats: formats to write the checks in (see output_sinks.SINKS), without 'excel' no workbook is created
+    :param output_dir: directory of the output files
+    :return:
+    """
+    sinks = output_sinks.get_sinks(output_formats, output_dir)
+
+    # Get start and end date
+    backfill = start_date is not None
+    if backfill:
+        windows = get_windows(start_date, end_date, window)
+        if not windows:
+            raise ValueError(f'No business days between {start_date} and {end_date}')
+        end_date = windows[-1][1]
+    else:
+        start_date, end_date = get_dates(0, 2)
+        windows = [(start_date, end_date)]
+
+    # Fetch universe, Reuters, EDI, Platform and ICE data concurrently
+    # Set to True, if you want to use EDI.csv file instead of API (located in dir: EDI/EDI.csv)
+    edi_manual_file = False
+    # Set to True, to reuse the Platform CAs stored by an earlier run for the same dates (located in dir: cache/platform)
+    plat_snapshot = False
+    sources = data_import.acquire_sources(start_date, end_date, edi_manual_file, plat_snapshot)
+
+    # Instance of Gigant ICE data to be used later on
+    gigant_instance = sources['universe']
+
+    reuters_data_dict, edi_data_dict, plat_data_dict = data_import.fetch_all_data(start_date, end_date, gigant_instance, sources)
+
+    # Store of the validated CAs for incremental validation
+    state_store = validation_state.ValidationStateStore() if incremental else None
+
+    checks_per_window = []
+    for window_start, window_end in windows:
+        # Compare Reuters, EDI and Platform
+        checks = data_analysis.analyze_datasets(data_import.select_window(reuters_data_dict, window_start, window_end),
+                                                data_import.select_window(edi_data_dict, window_start, window_end),
+                                                data_import.select_window(plat_data_dict, window_start, window_end),
+                                                gigant_instance, sources['ice'], state_store=state_store,
+                                                delta_only=delta_only)
+        if not backfill:
+            write_output(checks, window_end, 'CA_check', sinks)
+        elif combined:
+            checks_per_window.append(checks)
+        else:
+            write_output(checks, window_end, f'CA_check_{window_start}', sinks)
+
+    if checks_per_window:
+        write_output(combine_checks(checks_per_window), end_date, f'CA_check_{start_date}_{end_date}', sinks)
+
+    if state_store is not None:
+        state_store.close()
 
     return None
 
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Validates the corporate actions of Reuters, EDI and the Platform')
+    parser.add_argument('--start', help='First day of a backfill (YYYY-MM-DD), default: today')
+    parser.add_argument('--end', help='Last day of a backfill (YYYY-MM-DD)')
+    parser.add_argument('--window', type=int, default=0,
+                        help='Number of further business days compared with each backfill day')
+    parser.add_argument('--combined', action='store_true',
+                        help='Create one combined file for the backfill instead of one file per day')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only recompute CAs whose vendor values changed since the last run')
+    parser.add_argument('--delta-only', action='store_true',
+                        help='With --incremental, only output the recomputed CAs instead of all CAs')
+    parser.add_argument('--output', nargs='+', default=['excel'], choices=list(output_sinks.SINKS),
+                        help='Output formats, leave out excel to skip the workbook (default: excel)')
+    parser.add_argument('--output-dir', default='.', help='Directory of the output files')
+    args = parser.parse_args()
+    if (args.start is None) != (args.end is None):
+        parser.error('--start and --end are required together')
+    if args.start is not None:
+        try:
+            days = pd.bdate_range(args.start, args.end)
+        except ValueError as e:
+            parser.error(f'Invalid backfill range: {e}')
+        if days.empty:
+            parser.error(f'The backfill range {args.start} to {args.end} contains no business days '
+                         f'(--start must not be after --end)')
+    if args.window < 0:
+        parser.error('--window must not be negative')
+    if args.delta_only and not args.incremental:
+        parser.error('--delta-only requires --incremental')
+    main(args.start, args.end, args.window, args.combined, args.incremental, args.delta_only, args.output,
+         args.output_dir)
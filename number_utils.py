@@ -0,0 +1,29 @@
+import pandas as pd
+import numpy as np
+
+
+def near_tie(scaled):
+    """
+    Flags scaled values whose fractional part is within floating point error of .5
+    :param scaled: array of values multiplied by 10 ** digits
+    :return: boolean array
+    """
+    tolerance = np.maximum(1e-7, 64 * np.finfo(float).eps * np.abs(scaled))
+    with np.errstate(invalid='ignore'):
+        return np.abs(scaled - np.floor(scaled) - 0.5) < tolerance
+
+
+def round_values(values: pd.Series, digits=6) -> pd.Series:
+    """
+    Rounds a series like python's round, which rounds the exact decimal value of each float.
+    Series.round rounds the scaled value instead, which differs for values close to a tie (e.g. 1.6584495),
+    so these values are rounded with round
+    :param values: numeric series
+    :param digits:
+    :return: rounded series
+    """
+    values = values.astype(float)
+    rounded = values.round(digits).to_numpy(copy=True)
+    for i in np.flatnonzero(near_tie(values.to_numpy() * 10.0 ** digits)):
+        rounded[i] = round(float(values.iloc[i]), digits)
+    return pd.Series(rounded, index=values.index, name=values.name)
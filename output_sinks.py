@@ -0,0 +1,112 @@
+import pandas as pd
+import abc
+from loguru import logger
+import os
+import excel_funcs
+
+# File name suffix of each check dataframe, in the order of the checks
+CHECK_NAMES = ['stock_dividends', 'stock_splits', 'rights_issues', 'cash_dividends']
+
+
+def arrow_safe(df):
+    """
+    Converts object columns with mixed types (e.g. values and "" in the upload columns) to strings,
+    so that they can be stored by Arrow. Missing values are kept
+    :param df:
+    :return: dataframe
+    """
+    mixed = [col for col in df.select_dtypes(include='object').columns
+             if pd.api.types.infer_dtype(df[col], skipna=True) in ('mixed', 'mixed-integer')]
+    if not mixed:
+        return df
+    return df.assign(**{col: df[col].where(df[col].isnull(), df[col].astype(str)) for col in mixed})
+
+
+class OutputSink(abc.ABC):
+    """
+    Writes the checks of a run. Sinks write into the output directory, file names start with the run name
+    """
+    extension = None
+
+    def __init__(self, directory='.'):
+        self.directory = directory
+
+    def path(self, name, check_name=None):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = f'{name}_{check_name}.{self.extension}' if check_name else f'{name}.{self.extension}'
+        return os.path.join(self.directory, filename)
+
+    @abc.abstractmethod
+    def write(self, checks, end_date, name):
+        """
+        Writes the checks of the run
+        :param checks: stock div, stock split, rights and cash div checks
+        :param end_date:
+        :param name: name of the run, e.g. CA_check
+        :return:
+        """
+
+
+class ExcelSink(OutputSink):
+    """
+    Macro-enabled workbook for the manual validation and upload
+    """
+    extension = 'xlsm'
+
+    def write(self, checks, end_date, name):
+        # create_excel adds the manual handling columns, the frames are shared with the other sinks
+        checks = [df.copy(deep=False) for df in checks]
+        excel_funcs.create_excel(*checks, end_date, self.path(name))
+
+
+class CheckFileSink(OutputSink):
+    """
+    Writes one file per check dataframe
+    """
+    def write(self, checks, end_date, name):
+        for check_name, df in zip(CHECK_NAMES, checks):
+            self.write_check(df, self.path(name, check_name))
+        logger.debug(f'{self.extension} files of {name} successfully created!')
+
+    @abc.abstractmethod
+    def write_check(self, df, path):
+        """
+        Writes one check dataframe to the path
+        """
+
+
+class ParquetSink(CheckFileSink):
+    extension = 'parquet'
+
+    def write_check(self, df, path):
+        arrow_safe(df).to_parquet(path, index=False)
+
+
+class CsvSink(CheckFileSink):
+    extension = 'csv'
+
+    def write_check(self, df, path):
+        df.to_csv(path, index=False, date_format='%Y-%m-%d')
+
+
+class HtmlSink(CheckFileSink):
+    extension = 'html'
+
+    def write_check(self, df, path):
+        df.to_html(path, index=False, na_rep='')
+
+
+SINKS = {'excel': ExcelSink, 'parquet': ParquetSink, 'csv': CsvSink, 'html': HtmlSink}
+
+
+def get_sinks(formats, directory='.'):
+    """
+    Creates the output sinks
+    :param formats: keys of SINKS
+    :param directory: output directory
+    :return: list of sinks
+    """
+    unknown = [fmt for fmt in formats if fmt not in SINKS]
+    if unknown:
+        raise ValueError(f'Unknown output formats: {unknown}, available: {list(SINKS)}')
+    return [SINKS[fmt](directory) for fmt in formats]
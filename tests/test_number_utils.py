@@ -0,0 +1,22 @@
+import pandas as pd
+import number_utils
+
+
+# Values whose scaled form rounds differently than the exact decimal value
+TIE_VALUES = [1.6584495, 2.0123875, 2.3492895, 11.0392715]
+
+
+def test_round_values_matches_python_round_at_ties():
+    values = pd.Series(TIE_VALUES + [float('nan'), 2.5, 0.1234564])
+    rounded = number_utils.round_values(values)
+    expected = [round(value, 6) for value in values]
+    assert rounded.iloc[:4].tolist() == [1.658449, 2.012387, 2.349289, 11.039271]
+    assert rounded.iloc[4:].isnull().tolist() == [True, False, False]
+    assert rounded.drop(4).tolist() == [value for i, value in enumerate(expected) if i != 4]
+
+
+def test_round_values_keeps_index_and_name():
+    values = pd.Series([1.6584495, 3.0], index=[10, 20], name='GROSS')
+    rounded = number_utils.round_values(values)
+    assert rounded.index.tolist() == [10, 20]
+    assert rounded.name == 'GROSS'
@@ -0,0 +1,46 @@
+import pandas as pd
+import validation_state
+
+
+def vendor_frame():
+    return pd.DataFrame({'RIC': ['AAA.DE', 'AAA.DE', 'BBB.DE'],
+                         'Execution Date': pd.to_datetime(['2024-03-01', '2024-03-01', '2024-03-04']),
+                         'GROSS': [0.1234567, 0.123456789012345, 2.63996]})
+
+
+def context_frame():
+    return pd.DataFrame({'RIC': ['AAA.DE', 'BBB.DE'], 'ISIN': ['DE000A', 'DE000B']})
+
+
+def test_fingerprint_cas_with_ric_context():
+    fingerprints = validation_state.fingerprint_cas([vendor_frame()], [context_frame()])
+    assert fingerprints.index.names == validation_state.CA_UNIT
+    assert fingerprints.index.tolist() == [('AAA.DE', '2024-03-01'), ('BBB.DE', '2024-03-04')]
+
+    # Row order does not matter, context values of the RIC do
+    shuffled = validation_state.fingerprint_cas([vendor_frame().iloc[::-1]], [context_frame()])
+    assert shuffled.sort_index().equals(fingerprints.sort_index())
+    context = context_frame()
+    context.loc[1, 'ISIN'] = 'DE000C'
+    changed = validation_state.fingerprint_cas([vendor_frame()], [context])
+    assert (changed != fingerprints).tolist() == [False, True]
+
+
+def test_store_round_trip(tmp_path):
+    df = vendor_frame()
+    fingerprints = validation_state.fingerprint_cas([df], [context_frame()])
+    store = validation_state.ValidationStateStore(str(tmp_path / 'validation.sqlite'))
+    try:
+        assert store.changed('cash_dividends', fingerprints).index.equals(fingerprints.index)
+        store.save('cash_dividends', fingerprints, df)
+        assert store.changed('cash_dividends', fingerprints).empty
+
+        df.loc[2, 'GROSS'] = 2.64
+        updated = validation_state.fingerprint_cas([df], [context_frame()])
+        assert store.changed('cash_dividends', updated).index.tolist() == [('BBB.DE', '2024-03-04')]
+
+        loaded = store.load('cash_dividends', fingerprints.index, df.columns)
+        loaded = loaded.sort_values(['RIC', 'GROSS']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(loaded, vendor_frame(), check_dtype=False)
+    finally:
+        store.close()
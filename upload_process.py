@@ -1,176 +1,241 @@
 import pandas as pd
+import numpy as np
 import requests
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+import cache_utils
 
-def is_adhoc(date):
+def is_adhoc(dates: pd.Series):
     """
-    Check if date is ad-hoc (t to t+1) or not
-    :param date:
-    :return:
+    Check if dates are ad-hoc (t to t+1) or not
+    :param dates:
+    :return: array of 'YES'/'NO'
     """
-    today = datetime.date.today()
+    today = pd.Timestamp(datetime.date.today())
     next_bus_day = today + pd.tseries.offsets.BusinessDay()
-    if date <= next_bus_day:
-        return 'YES'
-    return 'NO'
+    return np.where(dates <= next_bus_day, 'YES', 'NO')
 
-def get_currency(RIC):
+CURRENCY_URL = "http://XYZ/internal-data/simple/getData?ref={ric}&q=CUR"
+CURRENCY_MAX_WORKERS = 16
+CURRENCY_TIMEOUT = 10
+# Set to True, to keep resolved currencies on disk between runs (see cache_utils.CACHE_DIR)
+CURRENCY_CACHE_PERSIST = False
+CURRENCY_CACHE_TTL = 7 * 24 * 60 * 60
+
+_currency_cache = cache_utils.TTLFrameCache('currencies', 'RIC', ['Currency'], ttl=CURRENCY_CACHE_TTL,
+                                            persist=CURRENCY_CACHE_PERSIST)
+
+
+def _fetch_currency(session, RIC):
     """
     Use equivalent to SGET formula to obtain currency
+    :param session: pooled requests session
     :param RIC:
-    :return:
+    :return: currency or None, if the request failed
     """
     try:
-        url = f"http://XYZ/internal-data/simple/getData?ref={RIC}&q=CUR"
-        response = requests.get(url)
-        curr = response.text
-    except:
-        curr = ""
-    return curr
+        response = session.get(CURRENCY_URL.format(ric=RIC), timeout=CURRENCY_TIMEOUT)
+        response.raise_for_status()
+        return response.text
+    except requests.RequestException as e:
+        logger.debug(f'Currency request for {RIC} failed: {e}')
+        return None
 
 
-def add_cash_div_upload_cols(df):
-    cash_divs_check = df.copy()
+def resolve_currencies(rics):
+    """
+    Resolves the currency of each unique RIC. RICs that are not cached yet are fetched concurrently
+    over one pooled keep-alive session.
+    :param rics: iterable of RICs
+    :return: dict RIC -> currency ("" if it could not be resolved)
+    """
+    unique_rics = pd.unique(pd.Series(list(rics), dtype=object).dropna()).tolist()
+    cached, missing = _currency_cache.get(unique_rics)
+    currencies = cached['Currency'].to_dict()
 
-    # Determine observations that are not yet in the platform
-    not_in_plat = cash_divs_check.loc[cash_divs_check['Plat_Currency'].isnull(),]
+    if missing:
+        logger.debug(f'Fetching currency for {len(missing)} RICs...')
+        workers = min(CURRENCY_MAX_WORKERS, len(missing))
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fetched = dict(zip(missing, executor.map(lambda ric: _fetch_currency(session, ric), missing)))
 
-    # Select observations that are validated by EDI and Reuters
-    not_plat_validated = not_in_plat.loc[(not_in_plat['Reuters-EDI_GROSS']) & (not_in_plat['Reuters-EDI_Currency']),]
+        # Only cache successful lookups, so failed RICs are retried in the next run
+        resolved = {ric: curr for ric, curr in fetched.items() if curr is not None}
+        _currency_cache.put(pd.DataFrame({'Currency': pd.Series(resolved, dtype=object)}))
+        currencies.update({ric: curr if curr is not None else "" for ric, curr in fetched.items()})
 
-    # Define the validated observations that are not yet in the platform as Uploads
-    cash_divs_check.loc[:, 'Upload?'] = 'No'
+    return currencies
 
-    cash_divs_check.loc[not_plat_validated.index, 'Upload?'] = 'Yes'
 
-    # Add the validated vendor-specific validated data points to dedicated upload columns
-    cash_divs_check.loc[:, 'Upload-Value'] = ""
-    cash_divs_check.loc[not_plat_validated.index, 'Upload-Value'] = cash_divs_check['Reuters_GROSS']
+def get_currency(RIC):
+    """
+    Use equivalent to SGET formula to obtain currency
+    :param RIC:
+    :return:
+    """
+    return resolve_currencies([RIC]).get(RIC, "")
 
-    cash_divs_check.loc[:, 'Upload-Currency'] = ""
-    cash_divs_check.loc[not_plat_validated.index, 'Upload-Currency'] = cash_divs_check['Reuters_Currency']
 
-    # Add necessary columns for upload: Currency, Dividend Subtype and Dividend Taxation Type
-    cash_divs_check.loc[:,'Upload-Dividend Subtype'] = "DEFAULT"
-    # Capture EST cases for .T, .KS, and .KQ exchanges
-    cash_divs_check['Exchange'] = cash_divs_check['RIC'].str.split('.').str[1]
-    cash_divs_check.loc[cash_divs_check['Exchange'].isin(['T', 'KS', 'KQ']), 'Upload-Dividend Subtype'] = 'EST'
-    cash_divs_check = cash_divs_check.drop(columns=['Exchange'], axis=1)
-
-    cash_divs_check.loc[:,'Upload-Dividend Taxation Type'] = cash_divs_check['Dividend Taxation Type']
-
-    # Add Withholding Tax Type - NET for ADRs & .IS instruments if net=gross
-    cash_divs_check.loc[:,'Upload-Withholding Taxation Type'] = 'GROSS'
-    cash_divs_check.loc[cash_divs_check['Additional Comment'].str.contains('ADR'),
-                        'Upload-Withholding Taxation Type'] = 'NET'
-    cash_divs_check.loc[(cash_divs_check['RIC'].str.contains(r'\.IS$'))
-                        & (cash_divs_check['Reuters_GROSS'] == cash_divs_check['Reuters_NET']),
-                        'Upload-Withholding Taxation Type'] = 'NET'
-    # For ADRs, adjust validation to use Net amount
-    cash_divs_check.loc[cash_divs_check['Additional Comment'].str.contains('ADR'), 'Upload-Value'] = ""
-    cash_divs_check.loc[cash_divs_check['Additional Comment'].str.contains('ADR'), 'Upload-Currency'] = ""
-    cash_divs_check.loc[cash_divs_check['Additional Comment'].str.contains('ADR'), 'Upload?'] = 'No'
-    adr_not_plat_validated = not_in_plat.loc[(not_in_plat['Reuters-EDI_NET']) &
-                                             (not_in_plat['Reuters-EDI_Currency']) &
-                                             (not_in_plat['Additional Comment'].str.contains('ADR')),]
-    cash_divs_check.loc[adr_not_plat_validated.index, 'Upload?'] = 'Yes'
-    cash_divs_check.loc[adr_not_plat_validated.index, 'Upload-Value'] = cash_divs_check['Reuters_NET']
-    cash_divs_check.loc[adr_not_plat_validated.index, 'Upload-Currency'] = cash_divs_check['Reuters_Currency']
-
-    # Add Ad-hoc column
-    cash_divs_check.loc[:, 'Upload-AdHoc'] = cash_divs_check['Execution Date'].apply(is_adhoc)
-
-    return cash_divs_check
+def map_currency(rics: pd.Series) -> pd.Series:
+    """
+    Maps a column of RICs to their currencies, resolving each unique RIC only once
+    :param rics: series of RICs
+    :return: series of currencies with the same index
+    """
+    return rics.map(resolve_currencies(rics)).fillna("")
 
 
-def add_split_upload_cols(df):
-    split_check = df.copy()
+def _validated(column):
+    """
+    Upload column that takes the vendor value for CAs that are uploaded and is empty otherwise
+    """
+    return lambda df, masks: df[column].astype(object).where(masks['upload'], "")
 
-    # Determine observations that are not yet in the platform
-    not_in_plat = split_check.loc[split_check['Plat_Relation'].isnull(),]
 
-    # Select observations that are validated by EDI and Reuters
-    not_plat_validated = not_in_plat.loc[not_in_plat['Reuters-EDI'],]
+def _upload_flag(df, masks):
+    return np.where(masks['upload'], 'Yes', 'No')
 
-    # Define the validated observations that are not yet in the platform as Uploads
-    split_check.loc[:, 'Upload?'] = 'No'
-    split_check.loc[not_plat_validated.index, 'Upload?'] = 'Yes'
 
-    # Add the validated vendor-specific validated data points to dedicated upload columns
-    split_check.loc[:, 'Upload-Relation'] = ""
-    split_check.loc[not_plat_validated.index, 'Upload-Relation'] = split_check['Reuters_Relation']
+def _adhoc(df, masks):
+    return is_adhoc(df['Execution Date'])
 
-    # Add necessary columns for upload: Currency, Dividend Subtype and Dividend Taxation Type
-    split_check.loc[:,'Upload-Currency'] = split_check['RIC'].apply(get_currency)
-    split_check.loc[:,'Upload-Dividend Subtype'] = "DEFAULT"
-    split_check.loc[:,'Upload-Dividend Taxation Type'] = "DEFAULT"
 
-    # Add Ad-hoc column
-    split_check.loc[:, 'Upload-AdHoc'] = split_check['Execution Date'].apply(is_adhoc)
+def _ric_currency(df, masks):
+    return map_currency(df['RIC'])
 
-    return split_check
 
+def _cash_div_value(df, masks):
+    # For ADRs, the net amount is uploaded
+    value = df['Reuters_GROSS'].where(~masks['adr'], df['Reuters_NET'])
+    return value.astype(object).where(masks['upload'], "")
 
-def add_stock_div_upload_cols(df):
-    stock_divs_check = df.copy()
 
+def _cash_div_subtype(df, masks):
+    # Capture EST cases for .T, .KS, and .KQ exchanges
+    exchange = df['RIC'].str.split('.').str[1]
+    return np.where(exchange.isin(['T', 'KS', 'KQ']), 'EST', 'DEFAULT')
+
+
+def _withholding_tax_type(df, masks):
+    # NET for ADRs & .IS instruments if net=gross
+    net = masks['adr'] | (df['RIC'].str.contains(r'\.IS$') & (df['Reuters_GROSS'] == df['Reuters_NET']))
+    return np.where(net, 'NET', 'GROSS')
+
+
+# Declarative description of the upload columns per CA type:
+#   platform_column: empty, if the CA is not yet in the platform
+#   validation_columns: checks that need to be True for a CA to be uploaded
+#   adr_validation_columns: checks used instead for ADRs (flagged in the Additional Comment)
+#   upload_columns: upload column -> constant, or function of the check frame and the shared masks
+UPLOAD_SPECS = {
+    'Stock dividends': {
+        'platform_column': 'Plat_Stock Dividend',
+        'validation_columns': ['Reuters-EDI'],
+        'upload_columns': {
+            'Upload?': _upload_flag,
+            'Upload-Stock Dividend': _validated('Reuters_Stock Dividend'),
+            'Upload-Currency': _ric_currency,
+            'Upload-Dividend Subtype': 'DEFAULT',
+            'Upload-Dividend Taxation Type': 'DEFAULT',
+            'Upload-AdHoc': _adhoc,
+        },
+    },
+    'Stock splits': {
+        'platform_column': 'Plat_Relation',
+        'validation_columns': ['Reuters-EDI'],
+        'upload_columns': {
+            'Upload?': _upload_flag,
+            'Upload-Relation': _validated('Reuters_Relation'),
+            'Upload-Currency': _ric_currency,
+            'Upload-Dividend Subtype': 'DEFAULT',
+            'Upload-Dividend Taxation Type': 'DEFAULT',
+            'Upload-AdHoc': _adhoc,
+        },
+    },
+    'Rights issues': {
+        'platform_column': 'Plat_Terms',
+        'validation_columns': ['Reuters-EDI'],
+        'upload_columns': {
+            'Upload?': _upload_flag,
+            'Upload-Terms': _validated('EDI_Terms'),
+            'Upload-Subscription Price': _validated('EDI_Subscription Price'),
+            'Upload-Currency': _validated('EDI_Currency'),
+            'Upload-Dividend Subtype': 'DEFAULT',
+            'Upload-Dividend Taxation Type': 'DEFAULT',
+            'Upload-AdHoc': _adhoc,
+            'Upload-Execution Order': 'SIMILAR',
+        },
+    },
+    'Cash dividends': {
+        'platform_column': 'Plat_Currency',
+        'validation_columns': ['Reuters-EDI_GROSS', 'Reuters-EDI_Currency'],
+        'adr_validation_columns': ['Reuters-EDI_NET', 'Reuters-EDI_Currency'],
+        'upload_columns': {
+            'Upload?': _upload_flag,
+            'Upload-Value': _cash_div_value,
+            'Upload-Currency': _validated('Reuters_Currency'),
+            'Upload-Dividend Subtype': _cash_div_subtype,
+            'Upload-Dividend Taxation Type': lambda df, masks: df['Dividend Taxation Type'],
+            'Upload-Withholding Taxation Type': _withholding_tax_type,
+            'Upload-AdHoc': _adhoc,
+        },
+    },
+}
+
+
+def _upload_masks(df, spec):
+    """
+    Computes the masks shared by the upload columns of a CA type
+    :param df: check dataframe
+    :param spec: upload spec of the CA type
+    :return: dict of boolean masks
+    """
     # Determine observations that are not yet in the platform
-    not_in_plat = stock_divs_check.loc[stock_divs_check['Plat_Stock Dividend'].isnull(),]
+    not_in_plat = df[spec['platform_column']].isnull()
+    if 'adr_validation_columns' in spec:
+        adr = df['Additional Comment'].str.contains('ADR', na=False)
+    else:
+        adr = pd.Series(False, index=df.index)
 
     # Select observations that are validated by EDI and Reuters
-    not_plat_validated = not_in_plat.loc[not_in_plat['Reuters-EDI'],]
-
-    # Define the validated observations that are not yet in the platform as Uploads
-    stock_divs_check.loc[:, 'Upload?'] = 'No'
-    stock_divs_check.loc[not_plat_validated.index, 'Upload?'] = 'Yes'
-
-    # Add the validated vendor-specific validated data points to dedicated upload columns
-    stock_divs_check.loc[:, 'Upload-Stock Dividend'] = ""
-    stock_divs_check.loc[not_plat_validated.index, 'Upload-Stock Dividend'] = stock_divs_check['Reuters_Stock Dividend']
-
-    # Add necessary columns for upload: Currency, Dividend Subtype and Dividend Taxation Type
-    stock_divs_check.loc[:,'Upload-Currency'] = stock_divs_check['RIC'].apply(get_currency)
-    stock_divs_check.loc[:,'Upload-Dividend Subtype'] = "DEFAULT"
-    stock_divs_check.loc[:,'Upload-Dividend Taxation Type'] = "DEFAULT"
-
-    # Add Ad-hoc column
-    stock_divs_check.loc[:, 'Upload-AdHoc'] = stock_divs_check['Execution Date'].apply(is_adhoc)
+    validated = df[spec['validation_columns']].fillna(False).astype(bool).all(axis=1)
+    if 'adr_validation_columns' in spec:
+        adr_validated = df[spec['adr_validation_columns']].fillna(False).astype(bool).all(axis=1)
+        validated = validated.where(~adr, adr_validated)
 
-    return stock_divs_check
+    return {'not_in_plat': not_in_plat, 'adr': adr, 'upload': not_in_plat & validated}
 
 
-def add_rights_upload_cols(df):
-    rights_check = df.copy()
-
-    # Determine observations that are not yet in the platform
-    not_plat = rights_check.loc[rights_check['Plat_Terms'].isnull(),]
-
-    # Select observations that are validated by EDI and Reuters,
-    not_plat_validated = not_plat.loc[not_plat['Reuters-EDI'],]
-
-    # Define the validated observations that are not yet in the platform as Uploads
-    rights_check.loc[:, 'Upload?'] = 'No'
-    rights_check.loc[not_plat_validated.index, 'Upload?'] = 'Yes'
+def add_upload_cols(df, ca_type):
+    """
+    Adds the upload columns of the CA type in a single pass. The check dataframe is not copied or modified
+    :param df: check dataframe
+    :param ca_type: key of UPLOAD_SPECS
+    :return: check dataframe with upload columns
+    """
+    spec = UPLOAD_SPECS[ca_type]
+    masks = _upload_masks(df, spec)
+    upload_cols = pd.DataFrame({column: value(df, masks) if callable(value) else value
+                                for column, value in spec['upload_columns'].items()}, index=df.index)
+    return pd.concat([df, upload_cols], axis=1, copy=False)
 
-    # Add the validated vendor-specific validated data points to dedicated upload columns
-    rights_check.loc[:, 'Upload-Terms'] = ""
-    rights_check.loc[not_plat_validated.index, 'Upload-Terms'] = rights_check['EDI_Terms']
 
-    rights_check.loc[:, 'Upload-Subscription Price'] = ""
-    rights_check.loc[not_plat_validated.index, 'Upload-Subscription Price'] = rights_check['EDI_Subscription Price']
+def add_cash_div_upload_cols(df):
+    return add_upload_cols(df, 'Cash dividends')
 
-    rights_check.loc[:, 'Upload-Currency'] = ""
-    rights_check.loc[not_plat_validated.index, 'Upload-Currency'] = rights_check['EDI_Currency']
 
-    # Add necessary columns for upload: Currency, Dividend Subtype and Dividend Taxation Type
-    rights_check.loc[:,'Upload-Dividend Subtype'] = "DEFAULT"
-    rights_check.loc[:,'Upload-Dividend Taxation Type'] = "DEFAULT"
+def add_split_upload_cols(df):
+    return add_upload_cols(df, 'Stock splits')
 
-    # Add Ad-hoc column
-    rights_check.loc[:, 'Upload-AdHoc'] = rights_check['Execution Date'].apply(is_adhoc)
 
-    # Add Execution Order column
-    rights_check.loc[:, 'Upload-Execution Order'] = 'SIMILAR'
+def add_stock_div_upload_cols(df):
+    return add_upload_cols(df, 'Stock dividends')
 
 
-    return rights_check
+def add_rights_upload_cols(df):
+    return add_upload_cols(df, 'Rights issues')
@@ -0,0 +1,147 @@
+import pandas as pd
+import numpy as np
+from loguru import logger
+import sqlite3
+import json
+import time
+import cache_utils
+
+# CAs are tracked per RIC and execution date: all check rows of such a unit (e.g. cash dividends with different
+# types or taxation types) are recomputed together, since the platform lookup compares across them
+CA_UNIT = ['RIC', 'Execution Date']
+# Increase when the check logic changes, so that results stored by older versions are recomputed
+STATE_VERSION = 1
+# Stored results are recomputed once they are older than the TTL in seconds, also if their inputs are unchanged
+STATE_TTL = 24 * 60 * 60
+
+
+def _unit_index(df):
+    """
+    Returns the CA unit of each row as string index (RIC, execution date in isoformat)
+    :param df: dataframe containing the CA unit columns
+    :return: MultiIndex
+    """
+    rics = df['RIC'].astype(str).to_numpy()
+    dates = pd.to_datetime(df['Execution Date']).dt.strftime('%Y-%m-%d').fillna('NaT').to_numpy()
+    return pd.MultiIndex.from_arrays([rics, dates], names=CA_UNIT)
+
+
+def _row_hashes(df, position):
+    # Multiplying by an odd number keeps the hashes distinct per dataframe
+    return pd.util.hash_pandas_object(df, index=False).to_numpy(dtype='uint64') * np.uint64(2 * position + 1)
+
+
+def fingerprint_cas(dfs, ric_context=()):
+    """
+    Fingerprints the CA units over the rows of all dataframes. The fingerprint changes if any vendor value
+    of the unit or any context value of its RIC changes, independent of the row order
+    :param dfs: vendor dataframes, their position is part of the fingerprint
+    :param ric_context: dataframes with a RIC column whose values enter the checks of the RIC
+    (e.g. universe, symbology or ICE data)
+    :return: series of hex fingerprints indexed by CA unit
+    """
+    if not dfs:
+        return pd.Series(dtype=object)
+    units = [_unit_index(df) for df in dfs]
+    hashes = [_row_hashes(df, position) for position, df in enumerate(dfs)]
+    codes, uniques = units[0].append(units[1:]).factorize()
+    sums = np.zeros(len(uniques), dtype='uint64')
+    np.add.at(sums, codes, np.concatenate(hashes))
+
+    unit_rics = uniques.get_level_values(0)
+    for position, df in enumerate(ric_context, start=len(dfs)):
+        if df.empty:
+            continue
+        ric_codes, rics = pd.factorize(df['RIC'].astype(str))
+        ric_sums = np.zeros(len(rics), dtype='uint64')
+        np.add.at(ric_sums, ric_codes, _row_hashes(df, position))
+        positions = pd.Index(rics).get_indexer(unit_rics)
+        sums += np.where(positions >= 0, ric_sums[positions], np.uint64(0)).astype('uint64')
+
+    return pd.Series([format(int(value), '016x') for value in sums], index=uniques.set_names(CA_UNIT), dtype=object)
+
+
+def select_cas(df, units):
+    """
+    Selects the rows of the given CA units
+    :param df:
+    :param units: MultiIndex of CA units
+    :return:
+    """
+    return df.loc[_unit_index(df).isin(units)]
+
+
+class ValidationStateStore:
+    """
+    Local SQLite store of the validated CAs. Per CA type and unit, the fingerprint of the input values and the
+    resulting check rows are kept, so that later runs only have to recompute units whose inputs changed.
+    Results expire after the ttl and are dropped when STATE_VERSION changes
+    """
+    def __init__(self, path=None, ttl=STATE_TTL):
+        self.path = path or cache_utils.cache_path('state', 'validation.sqlite')
+        self.ttl = ttl
+        self.con = sqlite3.connect(self.path)
+        if self.con.execute('PRAGMA user_version').fetchone()[0] != STATE_VERSION:
+            logger.debug('Validation state was stored by another version, recomputing all CAs')
+            self.con.execute('DROP TABLE IF EXISTS validation_state')
+            self.con.execute(f'PRAGMA user_version = {STATE_VERSION}')
+        self.con.execute('CREATE TABLE IF NOT EXISTS validation_state ('
+                         'ca_type TEXT NOT NULL, ric TEXT NOT NULL, execution_date TEXT NOT NULL, '
+                         'fingerprint TEXT NOT NULL, result TEXT NOT NULL, validated_at REAL NOT NULL, '
+                         'PRIMARY KEY (ca_type, ric, execution_date))')
+        self.con.commit()
+
+    def changed(self, ca_type, fingerprints):
+        """
+        Compares fingerprints with the stored ones that did not expire yet
+        :param ca_type:
+        :param fingerprints: series of fingerprints indexed by CA unit
+        :return: fingerprints of units that are new, changed or expired
+        """
+        stored = pd.read_sql_query('SELECT ric, execution_date, fingerprint FROM validation_state '
+                                   'WHERE ca_type = ? AND validated_at >= ?',
+                                   self.con, params=(ca_type, time.time() - self.ttl))
+        stored = stored.set_index(['ric', 'execution_date'])['fingerprint']
+        return fingerprints.loc[stored.reindex(fingerprints.index).to_numpy() != fingerprints.to_numpy()]
+
+    def save(self, ca_type, fingerprints, results):
+        """
+        Stores the check rows of the recomputed units together with their fingerprints
+        :param ca_type:
+        :param fingerprints: fingerprints of the recomputed units
+        :param results: check dataframe of the recomputed units
+        :return:
+        """
+        payload = results.copy()
+        for column in payload.select_dtypes(include='datetime').columns:
+            payload[column] = payload[column].dt.strftime('%Y-%m-%d')
+        units = _unit_index(results)
+        rows_per_unit = {unit: group.to_json(orient='records', double_precision=15) for unit, group in
+                         payload.groupby([units.get_level_values(0), units.get_level_values(1)], sort=False)}
+
+        validated_at = time.time()
+        self.con.executemany('INSERT OR REPLACE INTO validation_state VALUES (?, ?, ?, ?, ?, ?)',
+                             [(ca_type, ric, execution_date, fingerprint, rows_per_unit.get((ric, execution_date), '[]'),
+                               validated_at) for (ric, execution_date), fingerprint in fingerprints.items()])
+        self.con.commit()
+        logger.debug(f'Stored {len(fingerprints)} validated {ca_type} units')
+        return None
+
+    def load(self, ca_type, units, columns):
+        """
+        Reads the stored check rows of the given units
+        :param ca_type:
+        :param units: MultiIndex of CA units
+        :param columns: columns of the check dataframe
+        :return: check dataframe
+        """
+        stored = pd.read_sql_query('SELECT ric, execution_date, result FROM validation_state WHERE ca_type = ?',
+                                   self.con, params=(ca_type,))
+        stored = stored.loc[pd.MultiIndex.from_frame(stored[['ric', 'execution_date']]).isin(units)]
+        records = [record for result in stored['result'] for record in json.loads(result)]
+        df = pd.DataFrame.from_records(records, columns=columns)
+        df['Execution Date'] = pd.to_datetime(df['Execution Date'])
+        return df
+
+    def close(self):
+        self.con.close()